@@ -0,0 +1,108 @@
+
+# Compares the generated evaluator functions with the generic numpy evaluator
+# across interpolator sizes, and for compactly supported kernels the brute force
+# search for the poses within the radius (Evaluator.neighbours) with a KDTree
+# query. Run with blender's python, from the repository root:
+#
+#   blender --background --factory-startup --python benchmarks/evaluator.py
+import os
+import sys
+from timeit import repeat
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pose_shape_interpolator.codegen import CODEGEN_MAX_TERMS, CompiledEvaluator, evaluator_source
+from pose_shape_interpolator.evaluator import Evaluator
+from pose_shape_interpolator.kernels import KERNELS
+from pose_shape_interpolator.sparse import sparse_radius
+from pose_shape_interpolator.spatial import KDTree
+
+# (poses, channels)
+SIZES = ((4, 3), (8, 3), (8, 9), (12, 6), (16, 6), (24, 9), (32, 12), (64, 12))
+
+# (poses, channels) compared for the neighbour search
+COMPACT_SIZES = ((50, 3), (150, 6), (150, 12), (500, 12), (2000, 12), (8000, 12))
+
+NUMBER = 2000
+
+
+def best(function) -> float:
+    # Microseconds per call
+    return min(repeat(function, number=NUMBER, repeat=5)) / NUMBER * 1e6
+
+
+def main(kernel: str = 'GAUSSIAN') -> None:
+    rng = np.random.default_rng(0)
+    print(f'{kernel}, generated code is used up to {CODEGEN_MAX_TERMS} terms')
+    print(f'{"poses":>6} {"channels":>9} {"terms":>6} {"generic":>9} {"generated":>10} {"error":>9}')
+    for count, size in SIZES:
+        centers = rng.normal(size=(count, size))
+        distances = np.linalg.norm(centers[:, np.newaxis] - centers[np.newaxis], axis=-1)
+        radius = float(distances.mean())
+        weights = np.linalg.inv(KERNELS[kernel].function(distances, radius))
+        evaluator = Evaluator(centers,
+                              np.ones(size),
+                              weights,
+                              kernel,
+                              radius,
+                              np.zeros(count),
+                              np.ones(count),
+                              np.ones(count, dtype=bool),
+                              np.empty(0, dtype=np.intp))
+        # Generated past the limit too, for comparison
+        source = evaluator_source(centers,
+                                  evaluator.matrix,
+                                  evaluator.offset,
+                                  evaluator.clamp,
+                                  evaluator.clamp_min,
+                                  evaluator.clamp_max,
+                                  KERNELS[kernel].expression,
+                                  radius,
+                                  max_terms=sys.maxsize)
+        compiled = CompiledEvaluator(source, "benchmark")
+        args = tuple((centers[0] + rng.normal(scale=0.1, size=size)).tolist())
+        error = np.abs(np.array(compiled.evaluate(*args)) - evaluator.evaluate(args)).max()
+        generic = best(lambda: evaluator.evaluate(args).tolist())
+        generated = best(lambda: compiled.evaluate(*args))
+        terms = count * size + np.count_nonzero(evaluator.matrix)
+        print(f'{count:>6} {size:>9} {terms:>6} {generic:>7.1f}us {generated:>8.1f}us {error:>9.1e}')
+
+
+def neighbours_main(kernel: str = 'WENDLAND') -> None:
+    # With the sparse radius, which has the fewest poses within it and so is
+    # where a tree query does best
+    rng = np.random.default_rng(0)
+    function = KERNELS[kernel].function
+    print(f'{kernel}, poses within the radius found by brute force or a KDTree query')
+    print(f'{"poses":>6} {"channels":>9} {"found":>6} {"brute":>9} {"tree":>9}')
+    for count, size in COMPACT_SIZES:
+        centers = rng.uniform(size=(count, size))
+        radius = sparse_radius(centers)
+        evaluator = Evaluator(centers,
+                              np.ones(size),
+                              np.identity(count),
+                              kernel,
+                              radius,
+                              np.zeros(count),
+                              np.ones(count),
+                              np.zeros(count, dtype=bool),
+                              np.empty(0, dtype=np.intp))
+        tree = KDTree(centers)
+        vec = centers[count // 2] + rng.normal(scale=0.1 * radius, size=size)
+
+        def query() -> 'tuple[np.ndarray, np.ndarray]':
+            dist, indices = tree.query_radius(vec, radius)
+            return function(dist, radius), indices
+
+        found = evaluator.neighbours(vec)[1]
+        assert np.array_equal(np.sort(found), np.sort(query()[1]))
+        brute = best(lambda: evaluator.neighbours(vec))
+        queried = best(query)
+        print(f'{count:>6} {size:>9} {len(found):>6} {brute:>7.1f}us {queried:>7.1f}us')
+
+
+if __name__ == "__main__":
+    for name in KERNELS:
+        main(name)
+    neighbours_main()
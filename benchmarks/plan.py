@@ -0,0 +1,114 @@
+
+# Measures what rbf.bind_plans() weighs to decide whether planning a batch is
+# worth a pool of processes: the time to start the pool, and the time
+# bind_plan() takes per pose and channel and per pose cubed (the solve). Run
+# with blender's python, from the repository root:
+#
+#   blender --background --factory-startup --python benchmarks/plan.py
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from runpy import run_path
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pose_shape_interpolator.plan import InputSettings, PlanRequest, PoseSettings, bind_plan
+from pose_shape_interpolator.rbf import (
+    PARALLEL_MIN_SECONDS,
+    PLAN_SECONDS_PER_CHANNEL,
+    PLAN_SECONDS_PER_SOLVE,
+    WORKER_PATH
+    )
+
+# (inputs, poses), each input with a swing and twist rotation (four channels)
+SIZES = ((4, 50), (16, 100), (32, 200), (64, 400), (100, 800))
+
+
+def rotation_matrices(rng: 'np.random.Generator', shape: 'tuple[int, ...]') -> 'np.ndarray':
+    w, x, y, z = np.moveaxis(rng.normal(size=(*shape, 4)), -1, 0)
+    norm = 2.0 / (w * w + x * x + y * y + z * z)
+    matrices = np.zeros((*shape, 4, 4))
+    matrices[..., 0, :3] = np.stack((1.0 - norm * (y * y + z * z), norm * (x * y - w * z), norm * (x * z + w * y)), -1)
+    matrices[..., 1, :3] = np.stack((norm * (x * y + w * z), 1.0 - norm * (x * x + z * z), norm * (y * z - w * x)), -1)
+    matrices[..., 2, :3] = np.stack((norm * (x * z - w * y), norm * (y * z + w * x), 1.0 - norm * (x * x + y * y)), -1)
+    matrices[..., 3, 3] = 1.0
+    return matrices
+
+
+def plan_request(rng: 'np.random.Generator', inputs: int, poses: int) -> 'PlanRequest':
+    return PlanRequest("benchmark",
+                       tuple(InputSettings("Armature", f'Bone.{index:03}', (False, False, False), True,
+                                           'SWING_TWIST', 'Y', (False, False, False))
+                             for index in range(inputs)),
+                       rotation_matrices(rng, (inputs, poses)),
+                       tuple(PoseSettings(f'pose.{index}', f'Pose.{index:03}', 0.0, 1.0, True)
+                             for index in range(poses)),
+                       'GAUSSIAN',
+                       0.0,
+                       False,
+                       0.0,
+                       False,
+                       "",
+                       "",
+                       "")
+
+
+def best(function, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def pool_seconds(request: 'PlanRequest', processes: int) -> float:
+    # Start to first plan, each worker importing numpy and the planner
+    start = perf_counter()
+    with ProcessPoolExecutor(processes,
+                             mp_context=get_context('spawn'),
+                             initializer=run_path,
+                             initargs=(WORKER_PATH, {"PACKAGE": "pose_shape_interpolator"})) as pool:
+        for future in [pool.submit(bind_plan, request) for _ in range(processes)]:
+            future.result()
+    return perf_counter() - start
+
+
+def main() -> None:
+    rng = np.random.default_rng(0)
+    print(f'{"inputs":>7} {"poses":>6} {"plan":>9} {"reuse":>9}')
+    channels = []
+    cubes = []
+    planned = []
+    solved = []
+    for inputs, poses in SIZES:
+        request = plan_request(rng, inputs, poses)
+        # The same plan with the solution it made, i.e. without the solve
+        reused = request._replace(solution=bind_plan(request).solution)
+        channels.append(poses * inputs * 4)
+        cubes.append(poses ** 3)
+        solved.append(best(lambda: bind_plan(request)))
+        planned.append(best(lambda: bind_plan(reused)))
+        print(f'{inputs:>7} {poses:>6} {solved[-1]:>8.3f}s {planned[-1]:>8.3f}s')
+    # Least squares fits through the origin, dominated by the larger sizes
+    # that decide whether a batch is worth the pool
+    channels = np.array(channels, dtype=np.float64)
+    cubes = np.array(cubes, dtype=np.float64)
+    solves = np.maximum(np.array(solved) - np.array(planned), 0.0)
+    per_channel = np.dot(planned, channels) / np.dot(channels, channels)
+    per_solve = np.dot(solves, cubes) / np.dot(cubes, cubes)
+    print(f'PLAN_SECONDS_PER_CHANNEL {PLAN_SECONDS_PER_CHANNEL:.1e}, fitted {per_channel:.1e}')
+    print(f'PLAN_SECONDS_PER_SOLVE {PLAN_SECONDS_PER_SOLVE:.1e}, fitted {per_solve:.1e}')
+    # With p processes planning t seconds of work takes t/p plus the start, so
+    # the pool is faster from t = start * p/(p - 1), at most twice the start
+    processes = min(os.cpu_count() or 1, 4)
+    start = pool_seconds(plan_request(rng, 4, 50), processes)
+    print(f'PARALLEL_MIN_SECONDS {PARALLEL_MIN_SECONDS:.1f}, '
+          f'pool of {processes} started in {start:.2f}s, faster from {2.0 * start:.2f}s')
+
+
+if __name__ == "__main__":
+    main()
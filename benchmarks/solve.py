@@ -0,0 +1,52 @@
+
+# Compares the exact dense solve with the local sparse solve of a compactly
+# supported kernel across pose counts, to place SPARSE_MIN_POSES. Run with
+# blender's python, from the repository root:
+#
+#   blender --background --factory-startup --python benchmarks/solve.py
+import os
+import sys
+from time import perf_counter
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pose_shape_interpolator.kernels import KERNELS
+from pose_shape_interpolator.plan import distance_matrix, solve
+from pose_shape_interpolator.sparse import (
+    SPARSE_MAX_RESIDUAL,
+    SPARSE_MIN_POSES,
+    sparse_radius,
+    sparse_residual,
+    sparse_solve
+    )
+
+# (poses, channels)
+SIZES = ((300, 3), (1000, 6), (1000, 12), (1500, 12), (2000, 12), (4000, 12))
+
+
+def main(kernel: str = 'WENDLAND') -> None:
+    rng = np.random.default_rng(0)
+    function = KERNELS[kernel].function
+    print(f'{kernel}, sparse weights are solved locally from {SPARSE_MIN_POSES} poses, '
+          f'and exactly if |KW-I| exceeds {SPARSE_MAX_RESIDUAL:.0e}')
+    print(f'{"poses":>6} {"channels":>9} {"dense":>8} {"sparse":>8} {"residual":>9} {"|KW-I|":>9}')
+    for count, size in SIZES:
+        data = rng.uniform(size=(count, size))
+        radius = sparse_radius(data)
+        start = perf_counter()
+        kernel_matrix = function(distance_matrix(data), radius)
+        solve(kernel_matrix)
+        dense = perf_counter() - start
+        start = perf_counter()
+        weights = sparse_solve(data, function, radius)
+        sparse = perf_counter() - start
+        # The time it takes to check the approximation, and its result
+        start = perf_counter()
+        error = sparse_residual(data, function, radius, 0.0, weights)
+        residual = perf_counter() - start
+        print(f'{count:>6} {size:>9} {dense:>7.3f}s {sparse:>7.3f}s {residual:>8.3f}s {error:>9.1e}')
+
+
+if __name__ == "__main__":
+    main()
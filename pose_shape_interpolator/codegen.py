@@ -0,0 +1,140 @@
+
+import ast
+from collections import Counter
+from typing import TYPE_CHECKING
+import numpy as np
+if TYPE_CHECKING:
+    from typing import Callable
+
+# Interpolators larger than this (kernel terms plus nonzero weights) are left
+# to the generic numpy evaluator. Below it numpy's per-call overhead dominates,
+# above it the unrolled python is slower (see benchmarks/evaluator.py).
+CODEGEN_MAX_TERMS = 200
+
+# Nodes worth hoisting into a local when they appear more than once
+CSE_NODES = (ast.Call, ast.BinOp, ast.UnaryOp)
+
+CODEGEN_HEADER = "from math import exp, log, sqrt\n\n"
+
+# name -> the last functions compiled under it, so re-registering an unchanged
+# solution (on file load or undo) doesn't compile it again
+CODEGEN_CACHE: 'dict[str, CompiledEvaluator]' = {}
+
+
+class CompiledEvaluator:
+
+    def __init__(self, source: str, name: str) -> None:
+        namespace = {}
+        exec(compile(source, f'<{name}>', 'exec'), namespace)
+        self.source = source
+        # f(*vector) -> [value per pose]
+        self.evaluate: 'Callable[..., list[float]]' = namespace["evaluate"]
+        # f(*vector) -> [kernel value per pose]
+        self.kernels: 'Callable[..., list[float]]' = namespace["kernels"]
+
+
+class FunctionBuilder:
+
+    def __init__(self, name: str, args: 'list[str]') -> None:
+        self.name = name
+        self.args = args
+        self.lines = []
+        # expression -> local it's assigned to, so each is only computed once
+        self.locals = {}
+
+    def assign(self, expression: str) -> str:
+        name = self.locals.get(expression)
+        if name is None:
+            name = self.locals[expression] = f't{len(self.locals)}'
+            self.lines.append(f'    {name} = {expression}')
+        return name
+
+    def cse(self, expression: str) -> str:
+        # Hoists every subexpression that appears more than once into a local
+        tree = ast.parse(expression, mode='eval')
+        counts = Counter(ast.unparse(node) for node in ast.walk(tree) if isinstance(node, CSE_NODES))
+        builder = self
+
+        class Hoist(ast.NodeTransformer):
+
+            def visit(self, node: 'ast.AST') -> 'ast.AST':
+                text = ast.unparse(node) if isinstance(node, CSE_NODES) else None
+                node = self.generic_visit(node)
+                if text is not None and counts[text] > 1:
+                    return ast.Name(builder.assign(ast.unparse(node)), ast.Load())
+                return node
+
+        return ast.unparse(Hoist().visit(tree.body))
+
+    def source(self, result: str) -> str:
+        lines = [f'def {self.name}({", ".join(self.args)}):', *self.lines, f'    return {result}']
+        return "\n".join(lines) + "\n"
+
+
+def constant(value: float) -> str:
+    return repr(float(value))
+
+
+def signed_constant(value: float) -> str:
+    text = constant(value)
+    return text if text.startswith("-") else f'+{text}'
+
+
+def kernel_locals(builder: 'FunctionBuilder',
+                  centers: 'np.ndarray',
+                  template: str,
+                  radius: float) -> 'list[str]':
+    # |v - p|^2 / r^2 expanded to |v|^2/r^2 - 2v.p/r^2 + |p|^2/r^2, so the
+    # squared length of the input vector is shared by every pose and the rest
+    # is one multiply-add per channel with the constants folded in
+    args = builder.args
+    scale = 1.0 / (radius * radius)
+    length = builder.assign(f'({"+".join(f"{v}*{v}" for v in args)})*{constant(scale)}')
+    names = []
+    for center in centers:
+        terms = "".join(f'{signed_constant(-2.0 * p * scale)}*{v}' for v, p in zip(args, center) if p)
+        q = builder.assign(f'max({length}{signed_constant(center @ center * scale)}{terms},0.0)')
+        names.append(builder.assign(builder.cse(template.format(q=q))))
+    return names
+
+
+def evaluator_source(centers: 'np.ndarray',
+                     matrix: 'np.ndarray',
+                     offset: 'np.ndarray',
+                     clamp: 'np.ndarray',
+                     clamp_min: 'np.ndarray',
+                     clamp_max: 'np.ndarray',
+                     template: str,
+                     radius: float,
+                     max_terms: int = CODEGEN_MAX_TERMS) -> 'str|None':
+    # Unrolled python for an interpolator whose drivers pass the normalized
+    # pose-space vector, with the centers, weights and ranges inlined. None if
+    # it's too big to be worth it.
+    count, size = centers.shape
+    if count * size + np.count_nonzero(matrix) > max_terms:
+        return None
+    args = [f'v{i}' for i in range(size)]
+
+    kernels = FunctionBuilder("kernels", args)
+    names = kernel_locals(kernels, centers, template, radius)
+    source = kernels.source(f'[{", ".join(names)}]')
+
+    evaluate = FunctionBuilder("evaluate", args)
+    names = kernel_locals(evaluate, centers, template, radius)
+    bounds = {int(i): (lo, hi) for i, lo, hi in zip(clamp, clamp_min, clamp_max)}
+    values = []
+    for column in range(count):
+        terms = "".join(f'{signed_constant(w)}*{name}' for name, w in zip(names, matrix[:, column]) if w)
+        value = f'{constant(offset[column])}{terms}'
+        if column in bounds:
+            lo, hi = bounds[column]
+            value = f'min(max({value},{constant(lo)}),{constant(hi)})'
+        values.append(value)
+    return CODEGEN_HEADER + source + "\n\n" + evaluate.source(f'[{", ".join(values)}]')
+
+
+def evaluator_compile(source: str, name: str) -> 'CompiledEvaluator':
+    compiled = CODEGEN_CACHE.get(name)
+    if compiled is None or compiled.source != source:
+        compiled = CODEGEN_CACHE[name] = CompiledEvaluator(source, name)
+    return compiled
@@ -0,0 +1,263 @@
+
+from typing import TYPE_CHECKING
+import numpy as np
+import bpy
+from bpy.app.handlers import persistent
+from .codegen import CODEGEN_CACHE, CompiledEvaluator, evaluator_compile, evaluator_source
+from .kernels import KERNELS
+from .plan import DISTANCE_CACHE, TREE_CACHE, evaluator_name
+from .sparse import SparseMatrix
+if TYPE_CHECKING:
+    from typing import Sequence
+    from bpy.types import Key, bpy_struct
+    from .rna import PoseShapeInterpolator
+
+
+class Evaluator:
+
+    def __init__(self,
+            centers: 'np.ndarray',
+            scales: 'np.ndarray',
+            weights: 'np.ndarray|SparseMatrix',
+            kernel: str,
+            radius: float,
+            range_min: 'np.ndarray',
+            range_max: 'np.ndarray',
+            use_clamp: 'np.ndarray',
+            twist: 'np.ndarray',
+            propname: str = "") -> None:
+        self.centers = centers
+        self.scales = scales
+        # Range mapping is folded into the weights so evaluating every pose is a
+        # single matrix-vector product
+        if isinstance(weights, SparseMatrix):
+            self.matrix = weights.scale_columns(range_max - range_min)
+        else:
+            self.matrix = weights * (range_max - range_min)
+        self.function = KERNELS[kernel].function
+        self.radius = radius
+        # With a compactly supported kernel only poses within the radius have a
+        # nonzero kernel value, so those are the only ones weighted. They're
+        # found by brute force, which beats a tree query at any pose count
+        # drivers are evaluated with (see benchmarks/evaluator.py).
+        self.compact = KERNELS[kernel].compact
+        self.offset = range_min
+        self.clamp = np.flatnonzero(use_clamp)
+        self.clamp_min = np.minimum(range_min, range_max)[self.clamp]
+        self.clamp_max = np.maximum(range_min, range_max)[self.clamp]
+        self.twist = twist
+        # The key's ID property drivers read the pose-space vector from
+        self.propname = propname
+        # Generated functions (codegen.py) used in place of evaluate() and
+        # kernel_values() when set
+        self.compiled: 'CompiledEvaluator|None' = None
+        self._args = None
+        self._values = []
+        self._kernel_args = None
+        self._kernel_values = []
+
+    def __call__(self, index: int, owner: 'bpy_struct') -> float:
+        # Drivers pass the struct they drive (self) and the vector is read from
+        # its key. Every pose driver reads the same vector within a frame, so
+        # only the first call does any work.
+        args = owner.id_data[self.propname].to_list()
+        if args != self._args:
+            if self.compiled is not None:
+                self._values = self.compiled.evaluate(*args)
+            else:
+                self._values = self.evaluate(args).tolist()
+            self._args = args
+        return self._values[index]
+
+    def kernel(self, index: int, owner: 'bpy_struct') -> float:
+        args = owner.id_data[self.propname].to_list()
+        if args != self._kernel_args:
+            if self.compiled is not None:
+                self._kernel_values = self.compiled.kernels(*args)
+            else:
+                self._kernel_values = self.kernel_values(args).tolist()
+            self._kernel_args = args
+        return self._kernel_values[index]
+
+    def vector(self, args: 'Sequence[float]') -> 'np.ndarray':
+        vec = np.array(args, dtype=np.float64)
+        if len(self.twist):
+            vec[self.twist] = 2.0 * np.sin(vec[self.twist])
+        vec /= self.scales
+        return vec
+
+    def distances(self, vec: 'np.ndarray') -> 'np.ndarray':
+        delta = self.centers - vec
+        return np.sqrt(np.einsum('ij,ij->i', delta, delta))
+
+    def neighbours(self, vec: 'np.ndarray') -> 'tuple[np.ndarray, np.ndarray]':
+        dist = self.distances(vec)
+        indices = np.flatnonzero(dist < self.radius)
+        return self.function(dist[indices], self.radius), indices
+
+    def kernel_values(self, args: 'Sequence[float]') -> 'np.ndarray':
+        return self.function(self.distances(self.vector(args)), self.radius)
+
+    def evaluate(self, args: 'Sequence[float]') -> 'np.ndarray':
+        if self.compact:
+            k, indices = self.neighbours(self.vector(args))
+            if isinstance(self.matrix, SparseMatrix):
+                values = self.matrix.rows_dot(indices, k)
+            else:
+                values = k @ self.matrix[indices]
+        else:
+            values = self.kernel_values(args) @ self.matrix
+        values += self.offset
+        if len(self.clamp):
+            values[self.clamp] = np.clip(values[self.clamp], self.clamp_min, self.clamp_max)
+        return values
+
+
+def weights_load(data, count: int) -> 'np.ndarray|SparseMatrix':
+    weights = np.array(data["weights"], dtype=np.float64)
+    if "weights_indptr" in data:
+        return SparseMatrix(np.array(data["weights_indptr"], dtype=np.intp),
+                            np.array(data["weights_indices"], dtype=np.intp),
+                            weights,
+                            (count, count))
+    return weights.reshape(count, count)
+
+
+def evaluator_load(key: 'Key', handle: str) -> 'Evaluator|None':
+    data = key.get(f'{handle}.rbf')
+    if data is None:
+        return None
+    count = len(data["range_min"])
+    centers = np.array(data["centers"], dtype=np.float64).reshape(count, -1)
+    scales = np.array(data["scales"], dtype=np.float64)
+    twist = np.array(data.get("twist", ()), dtype=np.intp)
+    if data.get("vector"):
+        # Pose drivers pass the already normalized pose-space vector
+        scales = np.ones_like(scales)
+        twist = twist[:0]
+    kernel = data.get("kernel", 'GAUSSIAN')
+    evaluator = Evaluator(
+        centers,
+        scales,
+        weights_load(data, count),
+        kernel,
+        data["radius"],
+        np.array(data["range_min"], dtype=np.float64),
+        np.array(data["range_max"], dtype=np.float64),
+        np.array(data["use_clamp"], dtype=bool),
+        twist,
+        f'{handle}.vector'
+        )
+    if data.get("vector") and not isinstance(evaluator.matrix, SparseMatrix):
+        source = evaluator_source(centers,
+                                  evaluator.matrix,
+                                  evaluator.offset,
+                                  evaluator.clamp,
+                                  evaluator.clamp_min,
+                                  evaluator.clamp_max,
+                                  KERNELS[kernel].expression,
+                                  evaluator.radius)
+        if source is not None:
+            evaluator.compiled = evaluator_compile(source, f'{evaluator_name(handle)}.{key.name_full}')
+    return evaluator
+
+
+class KeyEvaluators:
+
+    def __init__(self, handle: str) -> None:
+        # What drivers call by name, the evaluators of one interpolator handle
+        # by key name. Duplicating a mesh copies its key, handle and drivers
+        # included, so each key has an evaluator of its own, loaded from its
+        # stored solution the first time its drivers call for it.
+        self.handle = handle
+        self.evaluators: 'dict[str, Evaluator]' = {}
+
+    def get(self, key: 'Key') -> 'Evaluator':
+        name = key.name_full
+        evaluator = self.evaluators.get(name)
+        if evaluator is None:
+            evaluator = evaluator_load(key, self.handle)
+            if evaluator is None:
+                raise RuntimeError(f'{name}: no solution for {self.handle}')
+            self.evaluators[name] = evaluator
+        return evaluator
+
+    def __call__(self, index: int, owner: 'bpy_struct') -> float:
+        return self.get(owner.id_data)(index, owner)
+
+    def kernel(self, index: int, owner: 'bpy_struct') -> float:
+        return self.get(owner.id_data).kernel(index, owner)
+
+
+def evaluator_register(psi: 'PoseShapeInterpolator') -> 'Evaluator|None':
+    handle = psi.handle
+    key = psi.id_data
+    evaluator = evaluator_load(key, handle)
+    namespace = bpy.app.driver_namespace
+    name = evaluator_name(handle)
+    evaluators = namespace.get(name)
+    if not isinstance(evaluators, KeyEvaluators):
+        evaluators = namespace[name] = KeyEvaluators(handle)
+    if evaluator is None:
+        evaluators.evaluators.pop(key.name_full, None)
+    else:
+        evaluators.evaluators[key.name_full] = evaluator
+    return evaluator
+
+
+def evaluator_unregister(psi: 'PoseShapeInterpolator') -> None:
+    # Only this key's evaluator is dropped, copies of the key may still call
+    # for theirs under the same name
+    name = evaluator_name(psi.handle)
+    key_name = psi.id_data.name_full
+    evaluators = bpy.app.driver_namespace.get(name)
+    if isinstance(evaluators, KeyEvaluators):
+        evaluators.evaluators.pop(key_name, None)
+    CODEGEN_CACHE.pop(f'{name}.{key_name}', None)
+    DISTANCE_CACHE.pop(psi.handle, None)
+    TREE_CACHE.pop(psi.handle, None)
+
+
+@persistent
+def evaluators_reload(*_) -> None:
+    # Evaluators are registered again from the solutions on the keys after a
+    # file load, and after undo and redo which put back solutions (and drivers
+    # calling them) without the evaluators that went with them. Stored
+    # solutions are used as they are unless the inputs, poses or settings have
+    # changed since they were solved.
+    from .rbf import bind, content_hash
+    namespace = bpy.app.driver_namespace
+    for name in [name for name, value in namespace.items() if isinstance(value, KeyEvaluators)]:
+        del namespace[name]
+    for key in bpy.data.shape_keys:
+        if not key.is_property_set("pose_shape_interpolators"):
+            continue
+        for psi in key.pose_shape_interpolators:
+            if not psi.is_bound:
+                continue
+            # Drivers from before python drivers passed self are rewritten
+            solution = key.get(f'{psi.handle}.rbf')
+            if solution is not None and (not solution.get("use_self")
+                                         or content_hash(psi)[1:] != (solution.get("solve_hash"),
+                                                                      solution.get("hash"))):
+                try:
+                    bind(psi)
+                    continue
+                except RuntimeError:
+                    pass
+            evaluator_register(psi)
+
+
+EVALUATOR_HANDLERS = ("load_post", "undo_post", "redo_post")
+
+
+def register() -> None:
+    for name in EVALUATOR_HANDLERS:
+        getattr(bpy.app.handlers, name).append(evaluators_reload)
+
+
+def unregister() -> None:
+    for name in EVALUATOR_HANDLERS:
+        handlers = getattr(bpy.app.handlers, name)
+        if evaluators_reload in handlers:
+            handlers.remove(evaluators_reload)
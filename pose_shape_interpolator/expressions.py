@@ -0,0 +1,101 @@
+
+import ast
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Iterable, Sequence
+
+# Blender stores driver expressions in a fixed size (256) char buffer
+MAX_EXPRESSION_LENGTH = 255
+
+# The subset of python that Blender's simple expression evaluator accepts
+# (BLI_expr_pylike_eval). Anything else is evaluated by python, which holds the
+# GIL and serializes multi-threaded depsgraph evaluation.
+SIMPLE_FUNCTIONS = frozenset((
+    "abs", "acos", "asin", "atan", "atan2", "ceil", "clamp", "cos", "degrees",
+    "exp", "fabs", "floor", "fmod", "int", "lerp", "log", "max", "min", "pow",
+    "radians", "round", "sin", "smoothstep", "sqrt", "tan", "trunc",
+))
+
+SIMPLE_CONSTANTS = frozenset(("pi", "True", "False", "frame"))
+
+SIMPLE_NODES = (
+    ast.Expression,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div,
+    ast.UnaryOp, ast.UAdd, ast.USub, ast.Not,
+    ast.BoolOp, ast.And, ast.Or,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+    ast.IfExp, ast.Call, ast.Name, ast.Load, ast.Constant,
+)
+
+
+def is_simple_expression(expression: str, variables: 'Iterable[str]') -> bool:
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        return False
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError:
+        return False
+    names = SIMPLE_CONSTANTS.union(variables)
+    for node in ast.walk(tree):
+        if not isinstance(node, SIMPLE_NODES):
+            return False
+        if isinstance(node, ast.Call):
+            if (node.keywords
+                    or not isinstance(node.func, ast.Name)
+                    or node.func.id not in SIMPLE_FUNCTIONS):
+                return False
+        elif isinstance(node, ast.Name):
+            if node.id not in names and node.id not in SIMPLE_FUNCTIONS:
+                return False
+        elif isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float, bool):
+                return False
+    return True
+
+
+def number(value: float) -> str:
+    return format(value, '.8g')
+
+
+def signed(value: float) -> str:
+    return format(value, '+.8g')
+
+
+def channel_value(name: str, kind: str) -> str:
+    return f'2*sin({name})' if kind == 'TWIST' else name
+
+
+def kernel_expression(template: str,
+                      names: 'Sequence[str]',
+                      kinds: 'Sequence[str]',
+                      center: 'Sequence[float]',
+                      scales: 'Sequence[float]',
+                      radius: float) -> str:
+    # |v/s - p|^2 / r^2 with the channel scales and radius folded into each
+    # term, i.e. ((v - p*s) / (s*r))^2, substituted into the kernel's template
+    terms = []
+    for name, kind, p, s in zip(names, kinds, center, scales):
+        offset = -p * s
+        value = channel_value(name, kind)
+        if offset:
+            value = f'({value}{signed(offset)})'
+        terms.append(f'pow({value}*{number(1.0 / (s * radius))},2)')
+    return template.format(q="+".join(terms))
+
+
+def output_expression(names: 'Sequence[str]',
+                      weights: 'Sequence[float]',
+                      range_min: float,
+                      range_max: float,
+                      use_clamp: bool) -> str:
+    factor = range_max - range_min
+    terms = "".join(f'{signed(w * factor)}*{name}' for name, w in zip(names, weights) if w)
+    if range_min:
+        expression = f'{number(range_min)}{terms}'
+    else:
+        expression = terms.lstrip("+") or "0"
+    if use_clamp:
+        lo = min(range_min, range_max)
+        hi = max(range_min, range_max)
+        expression = f'clamp({expression},{number(lo)},{number(hi)})'
+    return expression
@@ -1,6 +1,7 @@
 
 from typing import TYPE_CHECKING
 from bpy.types import Panel, UIList
+from .kernels import KERNELS
 if TYPE_CHECKING:
     from bpy.types import Context, ShaderNodeVectorCurve, UILayout
     from .ipo import InterpolationSettings
@@ -123,6 +124,28 @@ class PoseShapeInterpolatorsPanel:
             a, b = split_layout(col)
             a.label(text="Interpolation")
             ipo_settings_draw(b, psi)
+            a, b = split_layout(col)
+            a.label(text="Kernel")
+            b.prop(psi, "kernel", text="")
+            b.prop(psi, "radius")
+            row = b.row()
+            row.active = KERNELS[psi.kernel].compact
+            row.prop(psi, "use_sparse")
+            row = b.row(align=True)
+            sub = row.row(align=True)
+            sub.active = not psi.use_auto_regularization
+            sub.prop(psi, "regularization")
+            row.prop(psi, "use_auto_regularization", text="", icon='AUTO')
+            a, b = split_layout(col)
+            a.label(text="Drivers")
+            b.prop(psi, "driver_mode", text="")
+            row = col.row(align=True)
+            if psi.is_bound:
+                row.operator('pose_shape_interpolator.bind', text="Rebind")
+                row.operator('pose_shape_interpolator.unbind')
+            else:
+                row.operator('pose_shape_interpolator.bind')
+            row.operator('pose_shape_interpolator.bind_all', text="", icon='FILE_REFRESH')
 
 
 class PoseShapeInterpolatorInputsPanel:
@@ -265,6 +288,8 @@ class PoseShapeInterpolatorPosesPanel:
         ops = row.column(align=True)
         ops.operator('pose_shape_interpolator.pose_add', text="", icon='ADD')
         ops.operator('pose_shape_interpolator.pose_remove', text="", icon='REMOVE')
+        ops.operator('pose_shape_interpolator.pose_update', text="", icon='KEYFRAME_HLT')
+        ops.operator('pose_shape_interpolator.pose_select_nearest', text="", icon='VIEWZOOM')
         ops.separator()
         ops.operator('pose_shape_interpolator.pose_move_up', text="", icon='TRIA_UP')
         ops.operator('pose_shape_interpolator.pose_move_down', text="", icon='TRIA_DOWN')
@@ -0,0 +1,96 @@
+
+from typing import TYPE_CHECKING
+import numpy as np
+if TYPE_CHECKING:
+    from typing import Callable
+
+
+def gaussian(distances: 'np.ndarray', radius: float) -> 'np.ndarray':
+    return np.exp(-np.square(distances / radius))
+
+
+def multiquadric(distances: 'np.ndarray', radius: float) -> 'np.ndarray':
+    return np.sqrt(1.0 + np.square(distances / radius))
+
+
+def inverse_multiquadric(distances: 'np.ndarray', radius: float) -> 'np.ndarray':
+    return 1.0 / np.sqrt(1.0 + np.square(distances / radius))
+
+
+def thin_plate(distances: 'np.ndarray', radius: float) -> 'np.ndarray':
+    t = distances / radius
+    nonzero = t > 0.0
+    return np.where(nonzero, np.square(t) * np.log(np.where(nonzero, t, 1.0)), 0.0)
+
+
+def linear(distances: 'np.ndarray', radius: float) -> 'np.ndarray':
+    return distances / radius
+
+
+def wendland(distances: 'np.ndarray', radius: float) -> 'np.ndarray':
+    # Wendland C2, compactly supported within radius
+    t = distances / radius
+    return np.power(np.maximum(1.0 - t, 0.0), 4) * (4.0 * t + 1.0)
+
+
+class Kernel:
+
+    def __init__(self,
+            name: str,
+            description: str,
+            function: 'Callable[[np.ndarray, float], np.ndarray]',
+            expression: str,
+            compact: bool = False) -> None:
+        self.name = name
+        self.description = description
+        self.function = function
+        # Simple driver expression, in terms of the squared scaled distance {q}.
+        # Where {q} appears more than once it's read from a driver of its own.
+        self.expression = expression
+        # Zero beyond the radius, so only poses within it contribute
+        self.compact = compact
+
+
+KERNELS = {
+    'GAUSSIAN': Kernel(
+        "Gaussian",
+        "Smooth falloff, exp(-(d/r)^2)",
+        gaussian,
+        "exp(-({q}))"
+        ),
+    'MULTIQUADRIC': Kernel(
+        "Multiquadric",
+        "Grows with distance, sqrt(1+(d/r)^2)",
+        multiquadric,
+        "sqrt(1+{q})"
+        ),
+    'INVERSE_MULTIQUADRIC': Kernel(
+        "Inverse Multiquadric",
+        "Slow falloff, 1/sqrt(1+(d/r)^2)",
+        inverse_multiquadric,
+        "1/sqrt(1+{q})"
+        ),
+    'THIN_PLATE': Kernel(
+        "Thin Plate",
+        "Minimal bending, (d/r)^2*log(d/r)",
+        thin_plate,
+        "0.5*({q})*log(max({q},1e-300))"
+        ),
+    'LINEAR': Kernel(
+        "Linear",
+        "Piecewise linear, d/r",
+        linear,
+        "sqrt({q})"
+        ),
+    'WENDLAND': Kernel(
+        "Wendland",
+        "Compact support, zero beyond the radius",
+        wendland,
+        "pow(max(1-sqrt({q}),0),4)*(4*sqrt({q})+1)",
+        compact=True
+        ),
+}
+
+
+def kernel_matrix(distances: 'np.ndarray', kernel: str, radius: float) -> 'np.ndarray':
+    return KERNELS[kernel].function(distances, radius)
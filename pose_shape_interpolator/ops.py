@@ -5,6 +5,9 @@ if TYPE_CHECKING:
     from bpy.types import Context
 
 __all__ = (
+    "PoseShapeInterpolatorBind",
+    "PoseShapeInterpolatorBindAll",
+    "PoseShapeInterpolatorUnbind",
     "PoseShapeInterpolatorAdd",
     "PoseShapeInterpolatorRemove",
     "PoseShapeInterpolatorMoveUp",
@@ -15,11 +18,84 @@ __all__ = (
     "PoseShapeInterpolatorInputMoveDown",
     "PoseShapeInterpolatorPoseAdd",
     "PoseShapeInterpolatorPoseRemove",
+    "PoseShapeInterpolatorPoseUpdate",
+    "PoseShapeInterpolatorPoseSelectNearest",
     "PoseShapeInterpolatorPoseMoveUp",
     "PoseShapeInterpolatorPoseMoveDown",
 )
 
 
+class PoseShapeInterpolatorBind(Operator):
+
+    bl_label = "Bind"
+    bl_idname = 'pose_shape_interpolator.bind'
+    bl_description = "Build and activate drivers"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context: 'Context') -> bool:
+        ob = context.object
+        return (ob is not None
+                and ob.type == 'MESH'
+                and (sk := ob.data.shape_keys) is not None
+                and sk.is_property_set("pose_shape_interpolators")
+                and sk.pose_shape_interpolators.active is not None)
+
+    def execute(self, context: 'Context') -> set[str]:
+        psi = context.object.data.shape_keys.pose_shape_interpolators.active
+        try:
+            report = psi.bind()
+        except RuntimeError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        for message in report.warnings:
+            self.report({'WARNING'}, message)
+        self.report({'INFO'}, f'{psi.name}: {report.touched} driver(s) changed')
+        return {'FINISHED'}
+
+
+class PoseShapeInterpolatorBindAll(Operator):
+
+    bl_label = "Bind All"
+    bl_idname = 'pose_shape_interpolator.bind_all'
+    bl_description = "Build and activate drivers for every pose shape interpolator in the file"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context: 'Context') -> set[str]:
+        from .rbf import bind_all
+        report = bind_all()
+        for message in report.errors:
+            self.report({'ERROR'}, message)
+        for message in report.warnings:
+            self.report({'WARNING'}, message)
+        self.report({'INFO'}, (f'Bound {report.bound} interpolator(s), {report.touched} driver(s) changed '
+                               f'(read {report.read_time:.3f}s, solve {report.solve_time:.3f}s, '
+                               f'write {report.write_time:.3f}s)'))
+        return {'FINISHED'} if report.bound else {'CANCELLED'}
+
+
+class PoseShapeInterpolatorUnbind(Operator):
+
+    bl_label = "Unbind"
+    bl_idname = 'pose_shape_interpolator.unbind'
+    bl_description = "Remove drivers"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context: 'Context') -> bool:
+        ob = context.object
+        return (ob is not None
+                and ob.type == 'MESH'
+                and (sk := ob.data.shape_keys) is not None
+                and sk.is_property_set("pose_shape_interpolators")
+                and (psi := sk.pose_shape_interpolators.active) is not None
+                and psi.is_bound)
+
+    def execute(self, context: 'Context') -> set[str]:
+        context.object.data.shape_keys.pose_shape_interpolators.active.unbind()
+        return {'FINISHED'}
+
+
 class PoseShapeInterpolatorAdd(Operator):
 
     bl_label = "Add"
@@ -79,7 +155,7 @@ class PoseShapeInterpolatorMoveUp(Operator):
 
     def execute(self, context: 'Context') -> set[str]:
         ipos = context.object.data.shape_keys.pose_shape_interpolators
-        ipos.internal__.move(ipos.active_index, ipos.active_index - 1)
+        ipos.move(ipos.active_index, ipos.active_index - 1)
         ipos.active_index -= 1
         return {'FINISHED'}
 
@@ -102,7 +178,7 @@ class PoseShapeInterpolatorMoveDown(Operator):
 
     def execute(self, context: 'Context') -> set[str]:
         ipos = context.object.data.shape_keys.pose_shape_interpolators
-        ipos.internal__.move(ipos.active_index, ipos.active_index + 1)
+        ipos.move(ipos.active_index, ipos.active_index + 1)
         ipos.active_index += 1
         return {'CONTEXT'}
 
@@ -177,7 +253,7 @@ class PoseShapeInterpolatorInputMoveUp(Operator):
 
     def execute(self, context: 'Context') -> set[str]:
         inps = context.object.data.shape_keys.pose_shape_interpolators.active.inputs
-        inps.internal__.move(inps.active_index, inps.active_index - 1)
+        inps.move(inps.active_index, inps.active_index - 1)
         inps.active_index -= 1
         return {'FINISHED'}
 
@@ -227,7 +303,12 @@ class PoseShapeInterpolatorPoseAdd(Operator):
         ob = context.object
         kb = ob.shape_key_add(from_mix=False)
         kb.value = 1
-        ob.data.shape_keys.pose_shape_interpolators.active.poses.new(kb.name)
+        try:
+            ob.data.shape_keys.pose_shape_interpolators.active.poses.new(kb.name)
+        except RuntimeError as error:
+            ob.shape_key_remove(kb)
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
         return {'FINISHED'}
 
 
@@ -254,6 +335,63 @@ class PoseShapeInterpolatorPoseRemove(Operator):
         return {'FINISHED'}
 
 
+class PoseShapeInterpolatorPoseUpdate(Operator):
+
+    bl_label = "Update"
+    bl_idname = 'pose_shape_interpolator.pose_update'
+    bl_description = "Update the active pose from the current input state"
+    bl_options = {'UNDO', 'REGISTER'}
+
+    @classmethod
+    def poll(cls, context: 'Context') -> bool:
+        ob = context.object
+        return (ob is not None
+                and ob.type == 'MESH'
+                and (sk := ob.data.shape_keys) is not None
+                and sk.is_property_set("pose_shape_interpolators")
+                and (psi := sk.pose_shape_interpolators.active) is not None
+                and psi.poses.active is not None)
+
+    def execute(self, context: 'Context') -> set[str]:
+        pose = context.object.data.shape_keys.pose_shape_interpolators.active.poses.active
+        try:
+            pose.update()
+        except RuntimeError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        return {'FINISHED'}
+
+
+class PoseShapeInterpolatorPoseSelectNearest(Operator):
+
+    bl_label = "Select Nearest"
+    bl_idname = 'pose_shape_interpolator.pose_select_nearest'
+    bl_description = "Make the pose nearest to the current input state active"
+    bl_options = {'UNDO', 'REGISTER'}
+
+    @classmethod
+    def poll(cls, context: 'Context') -> bool:
+        ob = context.object
+        return (ob is not None
+                and ob.type == 'MESH'
+                and (sk := ob.data.shape_keys) is not None
+                and sk.is_property_set("pose_shape_interpolators")
+                and (psi := sk.pose_shape_interpolators.active) is not None
+                and psi.is_bound)
+
+    def execute(self, context: 'Context') -> set[str]:
+        psi = context.object.data.shape_keys.pose_shape_interpolators.active
+        try:
+            nearest = psi.nearest_poses(1)
+        except RuntimeError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        if not nearest:
+            return {'CANCELLED'}
+        psi.poses.active_index = psi.poses.find(nearest[0][0].name)
+        return {'FINISHED'}
+
+
 class PoseShapeInterpolatorPoseMoveUp(Operator):
 
     bl_label = "Up"
@@ -0,0 +1,699 @@
+
+from hashlib import sha1
+from typing import TYPE_CHECKING, NamedTuple
+import numpy as np
+from .expressions import (
+    channel_value,
+    is_simple_expression,
+    kernel_expression,
+    number,
+    output_expression
+    )
+from .kernels import KERNELS, kernel_matrix
+from .quaternions import aim_vectors, matrix_eulers, matrix_quaternions, quaternion_distance, twist_angles
+from .sparse import (
+    SPARSE_MAX_RESIDUAL,
+    SPARSE_MIN_POSES,
+    SparseMatrix,
+    sparse_radius,
+    sparse_residual,
+    sparse_solve
+    )
+from .spatial import KDTree
+if TYPE_CHECKING:
+    from typing import Iterator, Sequence
+
+# Planning a bind only takes plain values and arrays and never imports bpy, so
+# it can run outside of blender. Driver targets refer to objects by name and to
+# the interpolator's own key as None, the applier swaps in the actual IDs.
+
+
+class InputSettings(NamedTuple):
+    object: str
+    bone: str
+    use_location: 'tuple[bool, bool, bool]'
+    use_rotation: bool
+    rotation_mode: str
+    rotation_axis: str
+    use_scale: 'tuple[bool, bool, bool]'
+
+
+class PoseSettings(NamedTuple):
+    handle: str
+    name: str
+    range_min: float
+    range_max: float
+    use_clamp: bool
+
+
+class Solution(NamedTuple):
+    centers: 'np.ndarray'
+    scales: 'np.ndarray'
+    kernel: str
+    radius: float
+    regularization: float
+    weights: 'np.ndarray|SparseMatrix'
+
+
+class PlanRequest(NamedTuple):
+    handle: str
+    inputs: 'tuple[InputSettings, ...]'
+    # (inputs, poses, 4, 4) pose matrices
+    matrices: 'np.ndarray'
+    poses: 'tuple[PoseSettings, ...]'
+    kernel: str
+    radius: float
+    use_sparse: bool
+    # None searches for one
+    regularization: 'float|None'
+    simple: bool
+    # See rbf.content_hash()
+    data_hash: str
+    solve_hash: str
+    hash: str
+    # The last solution, used as is rather than solving again
+    solution: 'Solution|None' = None
+
+
+class Plan(NamedTuple):
+    handle: str
+    solution: 'Solution'
+    # What to store on the key, the pose settings and hashes only if the last
+    # solution was reused
+    data: dict
+    solved: bool
+    # ID property name -> array length
+    props: 'dict[str, int]'
+    # (data_path, index) -> driver spec
+    specs: 'dict[tuple[str, int], dict]'
+    warnings: 'tuple[str, ...]'
+
+
+QT_AIM_EXPR = {
+    'X': (
+        "1.0-2.0*(y*y+z*z)",
+        "2.0*(x*y+w*z)",
+        "2.0*(x*z-w*y)",
+    ),
+    'Y': (
+        "2.0*(x*y-w*z)",
+        "1.0-2.0*(x*x+z*z)",
+        "2.0*(y*z+w*x)",
+    ),
+    'Z': (
+        "2.0*(x*z+w*y)",
+        "2.0*(y*z-w*x)",
+        "1.0-2.0*(x*x+y*y)",
+    ),
+}
+
+
+SWING_PREFIX = 'psi_swing_'
+
+
+def swing_propname(settings: 'InputSettings') -> str:
+    # Aim vectors are shared by every interpolator on the key that reads the
+    # same bone's swing, so the property is named after what it's computed from
+    digest = sha1(repr((settings.object, settings.bone, 'SWING', settings.rotation_axis)).encode())
+    return f'{SWING_PREFIX}{digest.hexdigest()[:12]}'
+
+
+# One row per pose-space channel. kind is LOCATION, ANGLE, SWING, TWIST or
+# SCALE, axis is the transform axis (the aim vector component for SWING),
+# input indexes the inputs the table was built from and scale is the
+# channel's normalization, 1 until it's solved.
+CHANNEL_DTYPE = np.dtype([
+    ("kind", 'U8'),
+    ("axis", 'U1'),
+    ("input", np.intp),
+    ("scale", np.float64),
+])
+
+
+def input_channels(settings: 'InputSettings',
+                   matrices: 'np.ndarray') -> 'Iterator[tuple[str, str, np.ndarray]]':
+    # (kind, axis, value at each pose) for each of an input's channels
+    for flag, axis, column in zip(settings.use_location, 'XYZ', matrices[:, :3, 3].T):
+        if flag:
+            yield 'LOCATION', axis, column
+    if settings.use_rotation:
+        mode = settings.rotation_mode
+        axis = settings.rotation_axis
+        if mode == 'ANGLE':
+            yield 'ANGLE', axis, matrix_eulers(matrices)[:, 'XYZ'.index(axis)]
+        else:
+            qts = matrix_quaternions(matrices)
+            if 'SWING' in mode:
+                for component, column in zip('XYZ', aim_vectors(qts, axis).T):
+                    yield 'SWING', component, column
+            if 'TWIST' in mode:
+                yield 'TWIST', axis, 2.0 * np.sin(twist_angles(qts, axis))
+    if any(settings.use_scale):
+        scales = np.linalg.norm(matrices[:, :3, :3], axis=1)
+        for flag, axis, column in zip(settings.use_scale, 'XYZ', scales.T):
+            if flag:
+                yield 'SCALE', axis, column
+
+
+class ChannelTable:
+
+    def __init__(self, inputs: 'Sequence[InputSettings]', matrices: 'np.ndarray') -> None:
+        # matrices is (inputs, poses, 4, 4)
+        rows = []
+        columns = []
+        for index, (settings, input_matrices) in enumerate(zip(inputs, matrices)):
+            for kind, axis, column in input_channels(settings, input_matrices):
+                rows.append((kind, axis, index, 1.0))
+                columns.append(column)
+        self.inputs = tuple(inputs)
+        self.channels = np.array(rows, dtype=CHANNEL_DTYPE)
+        # (poses, channels)
+        self.posedata = np.empty((matrices.shape[1], len(columns)))
+        for index, column in enumerate(columns):
+            self.posedata[:, index] = column
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def indices(self, kind: str) -> 'np.ndarray':
+        return np.flatnonzero(self.channels["kind"] == kind)
+
+    def variable(self, index: int) -> dict:
+        # Driver variable type and targets reading the channel's raw value
+        kind, axis, input_, _ = self.channels[index].tolist()
+        settings = self.inputs[input_]
+        if kind == 'SWING':
+            return {
+                "type": 'SINGLE_PROP',
+                "targets": [{
+                    "id_type": 'KEY',
+                    "id": None,
+                    "data_path": f'["{swing_propname(settings)}"][{"XYZ".index(axis)}]'
+                }]
+            }
+        target = {
+            "id": settings.object,
+            "bone_target": settings.bone,
+            "transform_space": 'LOCAL_SPACE'
+        }
+        if kind == 'LOCATION':
+            target["transform_type"] = f'LOC_{axis}'
+        elif kind == 'SCALE':
+            target["transform_type"] = f'SCALE_{axis}'
+        else:
+            target["transform_type"] = f'ROT_{axis}'
+            target["rotation_mode"] = 'AUTO' if kind == 'ANGLE' else f'SWING_TWIST_{axis}'
+        return {"type": 'TRANSFORMS', "targets": [target]}
+
+    def variables(self) -> 'list[dict]':
+        return [self.variable(index) for index in range(len(self))]
+
+    def swing_inputs(self) -> 'list[InputSettings]':
+        return [self.inputs[i] for i in np.unique(self.channels["input"][self.indices('SWING')]).tolist()]
+
+    def swing_specs(self) -> 'dict[tuple[str, int], dict]':
+        # The aim vector drivers of every swing input, (data_path, index) -> spec
+        specs = {}
+        for settings in self.swing_inputs():
+            propname = swing_propname(settings)
+            for index, expr in enumerate(QT_AIM_EXPR[settings.rotation_axis]):
+                specs[(f'["{propname}"]', index)] = {
+                    "type": 'SCRIPTED',
+                    "expression": expr,
+                    "variables": [{
+                        "name": var,
+                        "type": 'TRANSFORMS',
+                        "targets": [{
+                            "id": settings.object,
+                            "bone_target": settings.bone,
+                            "rotation_mode": 'QUATERNION',
+                            "transform_space": 'LOCAL_SPACE',
+                            "transform_type": f'ROT_{var.upper()}'
+                        }]
+                    } for var in 'wxyz' if var in expr]
+                }
+        return specs
+
+
+def normalize_channels(data: 'np.ndarray') -> 'np.ndarray':
+    # Vectorized utils.normalize() applied to each channel (column) in place
+    norms = np.einsum('ij,ij->j', data, data)
+    norms[np.abs(norms) <= 1e-5] = 1.0
+    data /= norms
+    return norms
+
+
+def distance_matrix(data: 'np.ndarray') -> 'np.ndarray':
+    sq = np.einsum('ij,ij->i', data, data)
+    d2 = sq[:, np.newaxis] + sq[np.newaxis, :] - 2.0 * (data @ data.T)
+    np.maximum(d2, 0.0, out=d2)
+    np.fill_diagonal(d2, 0.0)
+    return np.sqrt(d2, out=d2)
+
+
+# handle -> (centers, distances) of the last bind, so that kernel changes can
+# re-solve without recomputing the pose distances
+DISTANCE_CACHE: 'dict[str, tuple[np.ndarray, np.ndarray]]' = {}
+
+
+def distance_matrix_cached(handle: str, data: 'np.ndarray') -> 'np.ndarray':
+    cached = DISTANCE_CACHE.get(handle)
+    if cached is not None and np.array_equal(cached[0], data):
+        return cached[1]
+    distances = distance_matrix(data)
+    DISTANCE_CACHE[handle] = (data, distances)
+    return distances
+
+
+# handle -> (centers, tree) of the last bind or query, rebuilt when the centers change
+TREE_CACHE: 'dict[str, tuple[np.ndarray, KDTree]]' = {}
+
+
+def pose_tree(handle: str, data: 'np.ndarray') -> 'KDTree':
+    cached = TREE_CACHE.get(handle)
+    if cached is not None and np.array_equal(cached[0], data):
+        return cached[1]
+    tree = KDTree(data)
+    TREE_CACHE[handle] = (data, tree)
+    return tree
+
+
+def pose_distances(inputs: 'Sequence[InputSettings]',
+                   matrices: 'np.ndarray',
+                   current: 'np.ndarray',
+                   scales: 'np.ndarray') -> 'np.ndarray':
+    # Distance from the current state, (inputs, 4, 4), to each pose, (inputs,
+    # poses, 4, 4), in the normalized pose space, except that the channels of a
+    # swing and twist input (the aim vector and twist, which measure the
+    # rotation in pieces) are replaced by the geodesic angle between the two
+    # rotations, normalized like those channels
+    table = ChannelTable(inputs, matrices)
+    if table.posedata.shape[1] != len(scales):
+        raise RuntimeError('Inputs have changed since the last bind')
+    delta = (table.posedata - ChannelTable(inputs, current[:, np.newaxis]).posedata) / scales
+    kinds = table.channels["kind"]
+    owner = table.channels["input"]
+    geodesic = np.array([settings.use_rotation and settings.rotation_mode == 'SWING_TWIST' for settings in inputs])
+    replaced = geodesic[owner] & ((kinds == 'SWING') | (kinds == 'TWIST'))
+    kept = delta[:, ~replaced]
+    squared = np.einsum('ij,ij->i', kept, kept)
+    for index in np.flatnonzero(geodesic).tolist():
+        angles = quaternion_distance(matrix_quaternions(matrices[index]), matrix_quaternions(current[index:index + 1]))
+        squared += np.square(angles / scales[replaced & (owner == index)].mean())
+    return np.sqrt(squared)
+
+
+def kernel_radius(distances: 'np.ndarray') -> float:
+    count = distances.shape[0]
+    if count < 2:
+        return 1.0
+    radius = distances.sum() / (count * (count - 1))
+    return radius if radius > 1e-5 else 1.0
+
+
+def solve(kernel: 'np.ndarray', regularization: float = 0.0) -> 'np.ndarray':
+    # Every pose drives its own shape key, so the targets are the identity and
+    # all of the weights come out of a single LU factorization.
+    if regularization:
+        kernel = kernel + regularization * np.identity(kernel.shape[0])
+    try:
+        return np.linalg.solve(kernel, np.identity(kernel.shape[0]))
+    except np.linalg.LinAlgError:
+        raise RuntimeError('Pose matrix is singular (check for duplicate poses)')
+
+
+# Regularization values tried by the leave-one-out search, relative to the
+# largest kernel matrix eigenvalue
+REGULARIZATION_GRID = np.concatenate(([0.0], np.logspace(-10.0, 0.0, 41)))
+
+# Regularizations leaving the kernel matrix worse conditioned than this aren't
+# considered, whatever their leave-one-out error
+REGULARIZATION_MAX_CONDITION = 1e6
+
+
+def loo_errors(eigenvalues: 'np.ndarray',
+               eigenvectors: 'np.ndarray',
+               lambdas: 'np.ndarray') -> 'np.ndarray':
+    # Rippa's closed form leave-one-out error for the identity targets, with
+    # A = inv(K + lambda*I): leaving pose i out misses shape j by A_ij / A_ii.
+    # The i == j terms are always one, so only the other shapes are scored,
+    # summed over every pose for each lambda. With K = V diag(e) V^T the row
+    # norms of A are the diagonal of A^2, so every lambda reuses the same
+    # decomposition and costs a matrix-vector product, not an inverse.
+    squared = np.square(eigenvectors)
+    errors = np.full(len(lambdas), np.inf)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for index, value in enumerate(lambdas.tolist()):
+            inverse = 1.0 / (eigenvalues + value)
+            diagonal = squared @ inverse
+            norms = squared @ np.square(inverse)
+            error = float(np.sum(norms / np.square(diagonal) - 1.0))
+            if np.isfinite(error):
+                errors[index] = error
+    return errors
+
+
+def solve_regularized(kernel: 'np.ndarray') -> 'tuple[np.ndarray, float]':
+    # Poses are interpolated exactly unless that leaves the solve badly
+    # conditioned (poses too close together). Then the regularization with the
+    # lowest leave-one-out error among the well conditioned ones is used. The
+    # weights reuse the same eigendecomposition.
+    eigenvalues, eigenvectors = np.linalg.eigh(kernel)
+    scale = np.abs(eigenvalues).max() or 1.0
+    lambdas = REGULARIZATION_GRID * scale
+    shifted = np.abs(eigenvalues[:, np.newaxis] + lambdas[np.newaxis, :])
+    with np.errstate(divide='ignore'):
+        condition = shifted.max(axis=0) / shifted.min(axis=0)
+    candidates = np.flatnonzero(condition <= REGULARIZATION_MAX_CONDITION)
+    if not len(candidates):
+        raise RuntimeError('Pose matrix is singular (check for duplicate poses)')
+    best = int(candidates[0])
+    if best != 0:
+        errors = loo_errors(eigenvalues, eigenvectors, lambdas[candidates])
+        if np.isfinite(errors).any():
+            best = int(candidates[np.argmin(errors)])
+    return (eigenvectors / (eigenvalues + lambdas[best])) @ eigenvectors.T, float(lambdas[best])
+
+
+def solve_weights(handle: str,
+                  data: 'np.ndarray',
+                  kernel: str,
+                  radius: float,
+                  sparse: bool,
+                  regularization: 'float|None') -> 'tuple[np.ndarray|SparseMatrix, float, float, tuple[str, ...]]':
+    # Returns the weights, the kernel radius (computed if radius is zero), the
+    # regularization (searched for if None) and any warnings
+    # Sparse weights use the radius within which poses have a few neighbours,
+    # but are only approximated where there are too many poses to solve exactly,
+    # and only kept if the approximation is close enough
+    warnings = ()
+    if sparse and KERNELS[kernel].compact:
+        radius = radius or sparse_radius(data)
+        if len(data) >= SPARSE_MIN_POSES:
+            if regularization is None:
+                raise RuntimeError((f'Automatic smoothing is not available for sparse weights '
+                                    f'with {SPARSE_MIN_POSES} or more poses'))
+            function = KERNELS[kernel].function
+            weights = sparse_solve(data, function, radius, regularization)
+            residual = sparse_residual(data, function, radius, regularization, weights)
+            if residual <= SPARSE_MAX_RESIDUAL:
+                return weights, radius, regularization, warnings
+            warnings = ((f'Sparse weights were off by up to {residual:.1e} at the poses, '
+                         f'so they were solved exactly instead'),)
+    distances = distance_matrix_cached(handle, data)
+    radius = radius or kernel_radius(distances)
+    matrix = kernel_matrix(distances, kernel, radius)
+    if regularization is None:
+        weights, regularization = solve_regularized(matrix)
+    else:
+        weights = solve(matrix, regularization)
+    return weights_compact(weights, matrix), radius, regularization, warnings
+
+
+# Weights are stored in single precision unless that would change the value
+# interpolated at any pose by more than this
+COMPACT_TOLERANCE = 1e-4
+
+
+def weights_compact(weights: 'np.ndarray', kernel: 'np.ndarray') -> 'np.ndarray':
+    compact = weights.astype(np.float32)
+    if np.abs(kernel @ (compact - weights)).max() <= COMPACT_TOLERANCE:
+        return compact
+    return weights
+
+
+def weights_store(solution, weights: 'np.ndarray|SparseMatrix') -> None:
+    if isinstance(weights, SparseMatrix):
+        solution["weights"] = weights.values.tolist()
+        solution["weights_indptr"] = weights.indptr.tolist()
+        solution["weights_indices"] = weights.indices.tolist()
+        return
+    if weights.dtype == np.float32:
+        # Stored as a float (rather than double) array through the buffer protocol
+        solution["weights"] = weights.ravel()
+    else:
+        solution["weights"] = weights.ravel().tolist()
+    for name in ("weights_indptr", "weights_indices"):
+        if name in solution:
+            del solution[name]
+
+
+def inverse_append(inverse: 'np.ndarray', column: 'np.ndarray', diagonal: float) -> 'np.ndarray':
+    # Inverse of [[K, b], [b^T, c]] from K^-1 via the Schur complement, O(n^2)
+    u = inverse @ column
+    schur = diagonal - column @ u
+    if abs(schur) < 1e-12:
+        raise RuntimeError('Pose matrix is singular (check for duplicate poses)')
+    count = inverse.shape[0]
+    result = np.empty((count + 1, count + 1))
+    result[:count, :count] = inverse + np.outer(u, u / schur)
+    result[:count, count] = result[count, :count] = -u / schur
+    result[count, count] = 1.0 / schur
+    return result
+
+
+def inverse_remove(inverse: 'np.ndarray', index: int) -> 'np.ndarray':
+    # Inverse of K with row/column index removed from K^-1, O(n^2)
+    column = np.delete(inverse[:, index], index)
+    row = np.delete(inverse[index], index)
+    result = np.delete(np.delete(inverse, index, 0), index, 1)
+    result -= np.outer(column, row / inverse[index, index])
+    return result
+
+
+def evaluator_name(handle: str) -> str:
+    return f'psi_{handle.replace("-", "")[:12]}'
+
+
+def variable_name(index: int) -> str:
+    # a-z followed by a0-z0, a1-z1 and so on, keeps driver expressions as
+    # short as possible
+    if index < 26:
+        return chr(97 + index)
+    index -= 26
+    return f'{chr(97 + index % 26)}{index // 26}'
+
+
+def driver_spec(expression: str, names: 'list[str]', channels: 'list[dict]', use_self: bool = False) -> dict:
+    return {
+        "type": 'SCRIPTED',
+        "expression": expression,
+        "use_self": use_self,
+        "variables": [{"name": name, "type": ch["type"], "targets": ch["targets"]}
+                      for name, ch in zip(names, channels)],
+    }
+
+
+def python_expression(handle: str, index: int, kernel: bool = False) -> str:
+    # Python drivers pass the struct they drive (self) and the evaluator reads
+    # the pose-space vector from its key, so the expression is the same length
+    # whatever the number of channels
+    func = evaluator_name(handle)
+    return f'{func}.kernel({index},self)' if kernel else f'{func}({index},self)'
+
+
+def python_driver_spec(handle: str, expression: str) -> dict:
+    # The one variable only makes the driver depend on the pose-space vector,
+    # drivers depend on the whole ID property whichever element they read
+    return driver_spec(expression, ["v"], vector_channels(handle, 1), use_self=True)
+
+
+def vector_channels(handle: str, count: int) -> 'list[dict]':
+    # The elements of the interpolator's normalized pose-space vector, which is
+    # all that pose drivers read
+    propname = f'{handle}.vector'
+    return [{
+        "name": f'v{index}',
+        "kind": 'VECTOR',
+        "type": 'SINGLE_PROP',
+        "targets": [{
+            "id_type": 'KEY',
+            "id": None,
+            "data_path": f'["{propname}"][{index}]'
+        }]
+    } for index in range(count)]
+
+
+def vector_specs(handle: str, table: 'ChannelTable') -> 'dict[tuple[str, int], dict]':
+    # One driver per channel, so each input is read and normalized once per
+    # frame rather than once per pose
+    propname = f'{handle}.vector'
+    specs = {}
+    for index, (kind, scale) in enumerate(zip(table.channels["kind"].tolist(), table.channels["scale"].tolist())):
+        expression = f'{channel_value("v", kind)}*{number(1.0 / scale)}'
+        specs[(f'["{propname}"]', index)] = driver_spec(expression, ["v"], [table.variable(index)])
+    return specs
+
+
+def pose_driver_path(pose: 'PoseSettings') -> 'tuple[str, int]':
+    return f'key_blocks["{pose.name}"].value', 0
+
+
+def python_driver_specs(handle: str, poses: 'Sequence[PoseSettings]') -> 'dict[tuple[str, int], dict]':
+    return {pose_driver_path(pose): python_driver_spec(handle, python_expression(handle, index))
+            for index, pose in enumerate(poses)}
+
+
+def kernel_staged(kernel: str) -> bool:
+    return KERNELS[kernel].expression.count("{q}") > 1
+
+
+def simple_driver_specs(handle: str,
+                        poses: 'Sequence[PoseSettings]',
+                        channels: 'list[dict]',
+                        data: 'np.ndarray',
+                        scales: 'Sequence[float]',
+                        kernel: str,
+                        radius: float,
+                        weights: 'np.ndarray') -> 'tuple[dict[tuple[str, int], dict], list[str]]':
+    # Two stages: the kernel value of every pose is written to an array on the
+    # key, then each pose's output is the weighted sum of that array. Kernels
+    # that use the squared distance more than once get a stage of their own
+    # writing it to another array, so it's only spelled out once. Anything
+    # that doesn't fit in a simple expression (including anything too long)
+    # falls back to the python evaluator.
+    count = len(poses)
+    names = [variable_name(i) for i in range(len(channels))]
+    kinds = [ch["kind"] for ch in channels]
+    knames = [variable_name(i) for i in range(count)]
+    template = KERNELS[kernel].expression
+    staged = kernel_staged(kernel)
+    fallbacks = []
+
+    kernels = []
+    distances = {}
+    for index, (pose, center) in enumerate(zip(poses, data.tolist())):
+        expr = None
+        if staged:
+            distance = kernel_expression("{q}", names, kinds, center, scales, radius)
+            if is_simple_expression(distance, names):
+                distances[index] = distance
+                expr = template.format(q="q")
+        else:
+            expr = kernel_expression(template, names, kinds, center, scales, radius)
+            if not is_simple_expression(expr, names):
+                expr = None
+        if expr is None:
+            kernels.append((python_expression(handle, index, kernel=True), True))
+            fallbacks.append(f'Pose "{pose.name}": kernel uses python ({len(channels)} channels)')
+        else:
+            kernels.append((expr, False))
+
+    outputs = []
+    for index, (pose, column) in enumerate(zip(poses, weights.T.tolist())):
+        expr = output_expression(knames, column, pose.range_min, pose.range_max, pose.use_clamp)
+        if is_simple_expression(expr, knames):
+            outputs.append((expr, False))
+        else:
+            outputs.append((python_expression(handle, index), True))
+            fallbacks.append(f'Pose "{pose.name}": output uses python ({count} poses)')
+
+    propname = f'{handle}.kernel'
+    distname = f'{handle}.distance'
+    specs = {}
+    for index, (expr, use_python) in enumerate(kernels):
+        if use_python:
+            specs[(f'["{propname}"]', index)] = python_driver_spec(handle, expr)
+        elif index in distances:
+            specs[(f'["{distname}"]', index)] = driver_spec(distances[index], names, channels)
+            specs[(f'["{propname}"]', index)] = driver_spec(expr, ["q"], [{
+                "type": 'SINGLE_PROP',
+                "targets": [{
+                    "id_type": 'KEY',
+                    "id": None,
+                    "data_path": f'["{distname}"][{index}]'
+                }]
+            }])
+        else:
+            specs[(f'["{propname}"]', index)] = driver_spec(expr, names, channels)
+
+    for column, (pose, (expr, use_python)) in enumerate(zip(poses, outputs)):
+        if use_python:
+            specs[pose_driver_path(pose)] = python_driver_spec(handle, expr)
+            continue
+        used = [index for index in range(count) if weights[index, column]]
+        specs[pose_driver_path(pose)] = driver_spec(expr, [knames[i] for i in used], [{
+            "type": 'SINGLE_PROP',
+            "targets": [{
+                "id_type": 'KEY',
+                "id": None,
+                "data_path": f'["{propname}"][{index}]'
+            }]
+        } for index in used])
+
+    return specs, fallbacks
+
+
+def pose_data(request: 'PlanRequest') -> dict:
+    # The part of a stored solution that changes without solving again
+    return {
+        "hash": request.hash,
+        "data_hash": request.data_hash,
+        "solve_hash": request.solve_hash,
+        "range_min": [pose.range_min for pose in request.poses],
+        "range_max": [pose.range_max for pose in request.poses],
+        "use_clamp": [int(pose.use_clamp) for pose in request.poses],
+        "poses": [pose.handle for pose in request.poses],
+    }
+
+
+def solution_data(request: 'PlanRequest', solution: 'Solution', table: 'ChannelTable') -> dict:
+    # The solution as it's stored on the key
+    data = {
+        **pose_data(request),
+        "centers": solution.centers.ravel().tolist(),
+        "scales": solution.scales.tolist(),
+        "kernel": solution.kernel,
+        "radius": solution.radius,
+        "regularization": solution.regularization,
+        "vector": 1,
+        # Python drivers pass self rather than every channel
+        "use_self": 1,
+    }
+    weights_store(data, solution.weights)
+    twist = table.indices('TWIST')
+    if len(twist):
+        data["twist"] = twist.tolist()
+    return data
+
+
+def bind_plan(request: 'PlanRequest') -> 'Plan':
+    handle = request.handle
+    poses = request.poses
+    table = ChannelTable(request.inputs, request.matrices)
+    vector = vector_channels(handle, len(table))
+
+    solution = request.solution
+    warnings = ()
+    if solution is None:
+        centers = table.posedata
+        scales = normalize_channels(centers)
+        weights, radius, regularization, warnings = solve_weights(handle, centers, request.kernel,
+                                                                  request.radius, request.use_sparse,
+                                                                  request.regularization)
+        solution = Solution(centers, scales, request.kernel, radius, regularization, weights)
+        data = solution_data(request, solution, table)
+    else:
+        data = pose_data(request)
+    table.channels["scale"] = solution.scales
+
+    props = {f'{handle}.vector': len(table)}
+    specs = vector_specs(handle, table)
+    for settings in table.swing_inputs():
+        props[swing_propname(settings)] = 3
+    specs.update(table.swing_specs())
+    if request.simple:
+        weights = solution.weights
+        if isinstance(weights, SparseMatrix):
+            weights = weights.toarray()
+        kernel_specs, fallbacks = simple_driver_specs(handle, poses, vector, solution.centers,
+                                                      [1.0] * len(vector), solution.kernel, solution.radius,
+                                                      weights)
+        props[f'{handle}.kernel'] = len(poses)
+        if kernel_staged(solution.kernel):
+            props[f'{handle}.distance'] = len(poses)
+        specs.update(kernel_specs)
+        warnings += tuple(fallbacks)
+    else:
+        specs.update(python_driver_specs(handle, poses))
+    return Plan(handle, solution, data, request.solution is None, props, specs, warnings)
@@ -0,0 +1,90 @@
+
+import numpy as np
+
+# Quaternions are (N, 4) arrays in Blender's (w, x, y, z) order. Aim vectors
+# and distances are invariant to the sign of the quaternion (q and -q), and
+# twist angles only change by a full turn, so it doesn't matter which of the
+# two a matrix decomposes to.
+
+
+def matrix_quaternions(matrices: 'np.ndarray') -> 'np.ndarray':
+    # Batched Matrix.to_quaternion(), (N, 3+, 3+) -> (N, 4), with the scale
+    # removed from each basis vector first
+    m = matrices[:, :3, :3]
+    m = m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    m00, m01, m02 = m[:, 0, 0], m[:, 0, 1], m[:, 0, 2]
+    m10, m11, m12 = m[:, 1, 0], m[:, 1, 1], m[:, 1, 2]
+    m20, m21, m22 = m[:, 2, 0], m[:, 2, 1], m[:, 2, 2]
+    # One candidate per largest component, picking the best conditioned
+    traces = np.stack((
+        1.0 + m00 + m11 + m22,
+        1.0 + m00 - m11 - m22,
+        1.0 - m00 + m11 - m22,
+        1.0 - m00 - m11 + m22,
+        ), axis=-1)
+    a = m21 - m12
+    b = m02 - m20
+    c = m10 - m01
+    d = m01 + m10
+    e = m02 + m20
+    f = m12 + m21
+    candidates = np.stack((
+        np.stack((traces[:, 0], a, b, c), axis=-1),
+        np.stack((a, traces[:, 1], d, e), axis=-1),
+        np.stack((b, d, traces[:, 2], f), axis=-1),
+        np.stack((c, e, f, traces[:, 3]), axis=-1),
+        ), axis=1)
+    best = np.argmax(traces, axis=1)
+    q = candidates[np.arange(len(m)), best]
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def matrix_eulers(matrices: 'np.ndarray') -> 'np.ndarray':
+    # Batched Matrix.to_euler() in XYZ order, (N, 3+, 3+) -> (N, 3). Of the two
+    # equivalent eulers the one with the smallest angles is picked, as blender does.
+    m = matrices[:, :3, :3]
+    m = m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    cy = np.hypot(m[:, 0, 0], m[:, 1, 0])
+    gimbal = cy <= 16.0 * np.finfo(np.float32).eps
+    a = np.stack((
+        np.where(gimbal, np.arctan2(-m[:, 1, 2], m[:, 1, 1]), np.arctan2(m[:, 2, 1], m[:, 2, 2])),
+        np.arctan2(-m[:, 2, 0], cy),
+        np.where(gimbal, 0.0, np.arctan2(m[:, 1, 0], m[:, 0, 0])),
+        ), axis=-1)
+    b = np.stack((
+        np.arctan2(-m[:, 2, 1], -m[:, 2, 2]),
+        np.arctan2(-m[:, 2, 0], -cy),
+        np.arctan2(-m[:, 1, 0], -m[:, 0, 0]),
+        ), axis=-1)
+    b[gimbal] = a[gimbal]
+    use_b = np.abs(a).sum(axis=1) > np.abs(b).sum(axis=1)
+    return np.where(use_b[:, np.newaxis], b, a)
+
+
+def aim_vectors(quaternions: 'np.ndarray', axis: str) -> 'np.ndarray':
+    # The rotated axis, (N, 4) -> (N, 3)
+    w, x, y, z = quaternions.T
+    if axis == 'X':
+        vectors = (1.0 - 2.0*(y*y + z*z), 2.0*(x*y + w*z), 2.0*(x*z - w*y))
+    elif axis == 'Y':
+        vectors = (2.0*(x*y - w*z), 1.0 - 2.0*(x*x + z*z), 2.0*(y*z + w*x))
+    else:
+        vectors = (2.0*(x*z + w*y), 2.0*(y*z - w*x), 1.0 - 2.0*(x*x + y*y))
+    return np.stack(vectors, axis=-1)
+
+
+def twist_angles(quaternions: 'np.ndarray', axis: str) -> 'np.ndarray':
+    # Quaternion.to_swing_twist(axis)[1], (N, 4) -> (N,)
+    return 2.0 * np.arctan2(quaternions[:, 'XYZ'.index(axis) + 1], quaternions[:, 0])
+
+
+def quaternion_distance(a: 'np.ndarray', b: 'np.ndarray') -> 'np.ndarray':
+    # Geodesic angle between unit quaternions, broadcast over leading axes
+    dot = np.abs(np.einsum('...i,...i->...', a, b))
+    return 2.0 * np.arccos(np.minimum(dot, 1.0))
+
+
+def quaternion_distances(quaternions: 'np.ndarray') -> 'np.ndarray':
+    # (N, 4) -> (N, N) pairwise geodesic angles
+    dot = np.abs(quaternions @ quaternions.T)
+    return 2.0 * np.arccos(np.minimum(dot, 1.0))
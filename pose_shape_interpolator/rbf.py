@@ -1,214 +1,54 @@
 
-from math import isclose, sin
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import sha1
+from multiprocessing import get_context
+from runpy import run_path
+from time import perf_counter
+import os
 from typing import TYPE_CHECKING
-from .utils import driver_ensure, normalize
+import numpy as np
+import bpy
+from .evaluator import evaluator_register, evaluator_unregister, weights_load
+from .kernels import KERNELS
+from .plan import (
+    DISTANCE_CACHE,
+    SWING_PREFIX,
+    ChannelTable,
+    InputSettings,
+    Plan,
+    PlanRequest,
+    PoseSettings,
+    Solution,
+    bind_plan,
+    inverse_append,
+    inverse_remove,
+    pose_distances,
+    pose_driver_path,
+    pose_tree,
+    python_driver_spec,
+    python_expression,
+    solve_weights,
+    weights_store
+    )
+from .utils import (
+    DriverIndex,
+    driver_ensure,
+    driver_find,
+    driver_remove,
+    driver_update,
+    drivers_sync,
+    pose_data_find
+    )
 if TYPE_CHECKING:
-    from typing import Iterable, TypeVar
-    from bpy.types import ID
-    from mathutils import Matrix
+    from typing import Iterable, Sequence
+    from bpy.types import ID, Key
     from .rna import (
         PoseShapeInterpolator,
         PoseShapeInterpolatorInput,
         PoseShapeInterpolatorPose
     )
-    T = TypeVar('T')
-
-
-def qt_aim_x(quaternion: 'tuple[float, float, float, float]') -> 'tuple[float, float, float]':
-    w, x, y, z = quaternion
-    return (1.0 - 2.0*(y*y + z*z), 2.0*(x*y + w*z), 2.0*(x*z - w*y))
-
-
-def qt_aim_y(quaternion: 'tuple[float, float, float, float]') -> 'tuple[float, float, float]':
-    w, x, y, z = quaternion
-    return (2.0*(x*y - w*z), 1.0 - 2.0*(x*x + z*z), 2.0*(y*z + w*x))
-
-
-def qt_aim_z(quaternion: 'tuple[float, float, float, float]') -> 'tuple[float, float, float]':
-    w, x, y, z = quaternion
-    return (2.0*(x*z + w*y), 2.0*(y*z - w*x), 1.0 - 2.0*(x*x + y*y))
-
-
-QT_AIM = {
-    'X': qt_aim_x,
-    'Y': qt_aim_y,
-    'Z': qt_aim_z,
-}
-
-
-QT_AIM_EXPR = {
-    'X': (
-        "1.0-2.0*(y*y+z*z)",
-        "2.0*(x*y+w*z)",
-        "2.0*(x*z-w*y)",
-    ),
-    'Y': (
-        "2.0*(x*y-w*z)",
-        "1.0-2.0*(x*x+z*z)",
-        "2.0*(y*z+w*x)",
-    ),
-    'Z': (
-        "2.0*(x*z+w*y)",
-        "2.0*(y*z-w*x)",
-        "1.0-2.0*(x*x+y*y)",
-    ),
-}
-
-
-class InputLayer:
-
-    def __init__(self,
-            input_: 'PoseShapeInterpolatorInput',
-            poses: 'list[PoseShapeInterpolatorPose]') -> None:
-        self.channels = []
-        self.posedata = []
-        self.vecnorms = []
-        matrices = [pose.data.get(input_).matrix for pose in poses]
-        self._add_location(input_, matrices)
-        self._add_rotation(input_, matrices)
-        self._add_scale(input_, matrices)
-
-    def _add_location(self, input_: 'PoseShapeInterpolatorInput', matrices: 'list[Matrix]') -> None:
-        flags = (
-            input_.use_location_x,
-            input_.use_location_y,
-            input_.use_location_z,
-        )
-        if not any(flags):
-            return
-        ob = input_.object
-        pb = input_.bone_target
-        for flag, axis, data in zip(flags, 'XYZ', zip(*[m.location for m in matrices])):
-            if not flag:
-                continue
-            seq = list(data)
-            self.posedata.append(seq)
-            self.vecnorms.append(normalize(seq))
-            self.channels.append({
-                "name": f'l{axis.lower()}',
-                "type": 'TRANSFORMS',
-                "targets": [{
-                    "transform_type": f'LOC_{axis}',
-                    "id": ob,
-                    "bone_target": pb,
-                    "transform_space": 'LOCAL_SPACE'
-                }]
-            })
-
-    def _add_rotation(self, input_: 'PoseShapeInterpolatorInput', matrices: 'list[Matrix]') -> None:
-        if not input_.use_rotation:
-            return
-        mode = input_.rotation_mode
-        axis = input_.rotation_axis
-        if mode == 'ANGLE':
-            self._add_rotation_angle(input_, matrices, axis)
-            return
-        if 'SWING' in mode:
-            self._add_rotation_swing(input_, matrices, axis)
-        if 'TWIST' in mode:
-            self._add_rotation_twist(input_, matrices, axis)
-
-    def _add_rotation_angle(self, input_: 'PoseShapeInterpolatorInput', matrices: 'list[Matrix]', axis: str) -> None:
-        idx = 'XYZ'.index(axis)
-        seq = [m.rotation_euler[idx] for m in matrices]
-        self.posedata.append(seq)
-        self.vecnorms.append(normalize(seq))
-        self.channels.append({
-            "name": "a",
-            "type": 'TRANSFORMS',
-            "targets": [{
-                "id": input_.object,
-                "bone_target": input_.name,
-                "transform_type": f'ROT_{axis}',
-                "transform_space": 'LOCAL_SPACE',
-                "rotation_mode": 'AUTO'
-            }]
-        })
-
-    def _add_rotation_swing(self, input_: 'PoseShapeInterpolatorInput', matrices: 'list[Matrix]', axis: str) -> None:
-        qts = [mat.rotation_quaternion for mat in matrices]
-        mat = map(list, zip(*map(QT_AIM[axis], qts)))
-        key = input_.id_data
-        propname = input_.handle
-        for index, (axis, seq, expr) in enumerate(zip('XYZ', mat, QT_AIM_EXPR[axis])):
-            path = f'["{propname}"][{index}]'
-            self.posedata.append(seq)
-            self.vecnorms.append(normalize(seq))
-            self.channels.append({
-                "name": f'd{axis.lower()}',
-                "type": 'SINGLE_PROP',
-                "targets": [{
-                    "id_type": 'KEY',
-                    "id": key,
-                    "data_path": path
-                }]
-            })
-            fc = driver_ensure(key, path, index, clear_variables=True)
-            dr = fc.driver
-            dr.type = 'SCRIPTED'
-            dr.expression = expr
-            for axis in 'wxyz':
-                if axis not in expr:
-                    continue
-                var = dr.variables.new()
-                var.type = 'TRANSFORMS'
-                var.name = axis
-                tgt = var.targets[0]
-                tgt.id = input_.object
-                tgt.bone_target = input_.bone_target
-                tgt.rotation_mode = 'QUATERNION'
-                tgt.transform_space = 'LOCAL_SPACE'
-                tgt.transform_type = f'ROT_{axis.upper()}'
-
-
-    def _add_rotation_twist(self, input_: 'PoseShapeInterpolatorInput', matrices: 'list[Matrix]', axis: str) -> None:
-        qts = [mat.rotation_quaternion for mat in matrices]
-        seq = [2.0 * sin(qt.to_swing_twist(axis)[1]) for qt in qts]
-        self.posedata.append(seq)
-        self.vecnorms.append(normalize(seq))
-        self.channels.append({
-            "name": "s",
-            "type": 'TRANSFORMS',
-            "targets": [{
-                "id": input_.object,
-                "bone_target": input_.name,
-                "transform_type": f'ROT_{axis}',
-                "transform_space": 'LOCAL_SPACE',
-                "rotation_mode": f'SWING_TWIST_{axis}'
-            }]
-        })
-
-    def _add_scale(self, input_: 'PoseShapeInterpolatorInput', matrices: 'list[Matrix]') -> None:
-        flags = (
-            input_.use_scale_x,
-            input_.use_scale_y,
-            input_.use_scale_z,
-        )
-        if not any(flags):
-            return
-        ob = input_.object
-        pb = input_.bone_target
-        for flag, axis, data in zip(flags, 'XYZ', zip(*[m.location for m in matrices])):
-            if not flag:
-                continue
-            seq = list(data)
-            self.posedata.append(seq)
-            self.vecnorms.append(normalize(seq))
-            self.channels.append({
-                "name": f's{axis.lower()}',
-                "type": 'TRANSFORMS',
-                "targets": [{
-                    "transform_type": f'SCALE_{axis}',
-                    "id": ob,
-                    "bone_target": pb,
-                    "transform_space": 'LOCAL_SPACE'
-                }]
-            })
-
-
-
-
-
 
 
 class IDProperty:
@@ -223,10 +63,6 @@ class IDProperty:
         }]
 
 
-def transpose_matrix(m: Iterable[Iterable[T]]) -> list[list[T]]:
-    return list(map(list, zip(*m)))
-
-
 def read_inputs(
         psi: 'PoseShapeInterpolator'
         ) -> 'list[PoseShapeInterpolatorInput]':
@@ -254,37 +90,738 @@ def read_poses(
     return poses
 
 
-def read_data_matrices(
-        poses: 'Iterable[PoseShapeInterpolatorPose]'
-        ) -> 'tuple[list[list[Matrix]], list[list[Matrix]]]':
-    pose_data_matrix: 'list[list[Matrix]]' = []
+def content_hash(psi: 'PoseShapeInterpolator',
+                 removed: 'PoseShapeInterpolatorPose|None' = None) -> 'tuple[str, str, str]':
+    # Stable hashes of the inputs and pose data a solution depends on, of that
+    # data together with the kernel settings (what the solve depends on), and
+    # of the data together with the pose and driver settings (what the drivers
+    # and stored pose ranges depend on). removed is a pose that is about to be
+    # removed and is left out.
+    digest = sha1()
+
+    def update(hasher, *values) -> None:
+        hasher.update(repr(values).encode())
+
+    inputs = list(psi.inputs)
+    poses = [pose for pose in psi.poses if removed is None or pose != removed]
+    matrices, found = read_data_matrices(inputs, poses)
+    for inp in inputs:
+        ob = inp.object
+        update(digest,
+               inp.handle,
+               "" if ob is None else ob.name,
+               inp.name,
+               inp.use_location_x,
+               inp.use_location_y,
+               inp.use_location_z,
+               inp.use_rotation,
+               inp.rotation_mode,
+               inp.rotation_axis,
+               inp.use_scale_x,
+               inp.use_scale_y,
+               inp.use_scale_z)
+    for pose, pose_matrices, pose_found in zip(poses, matrices, found.tolist()):
+        update(digest, pose.handle)
+        for matrix, is_found in zip(pose_matrices, pose_found):
+            if is_found:
+                digest.update(matrix.tobytes())
+            else:
+                update(digest, None)
+    solve = digest.copy()
+    update(solve,
+           psi.kernel,
+           psi.radius,
+           psi.use_sparse,
+           psi.use_auto_regularization,
+           None if psi.use_auto_regularization else psi.regularization)
+    drivers = digest.copy()
     for pose in poses:
-        pose_data_matrix.append([x.matrix for x in pose.data])
-    input_data_matrix: 'list[list[Matrix]]' = transpose_matrix(pose_data_matrix)
-    return pose_data_matrix, input_data_matrix
+        update(drivers,
+               pose.name,
+               pose.range_min,
+               pose.range_max,
+               pose.use_clamp,
+               pose.interpolation,
+               pose.easing)
+    update(drivers, psi.driver_mode, psi.interpolation, psi.easing)
+    return digest.hexdigest(), solve.hexdigest(), drivers.hexdigest()
 
 
-def unbind(psi: 'PoseShapeInterpolator') -> None:
-    pass
-
-
-def bind(psi: 'PoseShapeInterpolator') -> None:
-
+def read_data_matrices(
+        inputs: 'Sequence[PoseShapeInterpolatorInput]',
+        poses: 'Sequence[PoseShapeInterpolatorPose]'
+        ) -> 'tuple[np.ndarray, np.ndarray]':
+    # (poses, inputs, 4, 4) pose data matrices read with one foreach_get per
+    # pose, and (poses, inputs) flags for the inputs that had data at each pose
+    # (identity where they didn't)
+    matrices = np.empty((len(poses), len(inputs), 4, 4), dtype=np.float64)
+    found = np.empty((len(poses), len(inputs)), dtype=bool)
+    handles = [inp.handle for inp in inputs]
+    buffer = np.empty(0, dtype=np.float32)
+    for pose, out, out_found in zip(poses, matrices, found):
+        data = pose.data
+        items = data.internal__
+        count = len(items)
+        if buffer.size != count * 16:
+            buffer = np.empty(count * 16, dtype=np.float32)
+        items.foreach_get("matrix", buffer)
+        # Matrix properties are stored column major
+        values = buffer.reshape(count, 4, 4).transpose(0, 2, 1)
+        indices = np.array([pose_data_find(data, items, handle) for handle in handles], dtype=np.intp)
+        np.not_equal(indices, -1, out=out_found)
+        out[out_found] = values[indices[out_found]]
+        out[~out_found] = np.identity(4)
+    return matrices, found
+
+
+def input_matrices(
+        inputs: 'Sequence[PoseShapeInterpolatorInput]',
+        poses: 'Sequence[PoseShapeInterpolatorPose]'
+        ) -> 'np.ndarray':
+    # (inputs, poses, 4, 4) as planning takes them
+    matrices, found = read_data_matrices(inputs, poses)
+    if not found.all():
+        pose, input_ = np.argwhere(~found)[0].tolist()
+        raise RuntimeError(f'Missing pose data: "{poses[pose].name}", "{inputs[input_].name}"')
+    return np.ascontiguousarray(matrices.swapaxes(0, 1))
+
+
+def regularization_get(psi: 'PoseShapeInterpolator') -> 'float|None':
+    return None if psi.use_auto_regularization else psi.regularization
+
+
+def regularization_set(psi: 'PoseShapeInterpolator', regularization: float) -> None:
+    # Set as an ID property so the chosen value doesn't trigger another solve
+    if psi.use_auto_regularization:
+        psi["regularization"] = regularization
+
+
+def owned_get(key: 'Key', handle: str) -> 'tuple[list[str], list[tuple[str, int]]]':
+    # The ID properties and drivers (data_path, index) the last bind created
+    solution = key.get(f'{handle}.rbf')
+    if solution is not None and "owned_props" in solution:
+        return (list(solution["owned_props"]),
+                list(zip(solution["owned_paths"], solution["owned_indices"])))
+    # Bound before ownership was recorded
+    props = [name for name in key.keys() if name.startswith(handle)]
+    drivers = []
+    ad = key.animation_data
+    if ad is not None:
+        prefix = f'["{handle}'
+        drivers = [(fc.data_path, fc.array_index) for fc in ad.drivers if fc.data_path.startswith(prefix)]
+    return props, drivers
+
+
+def owned_set(solution, props: 'Iterable[str]', drivers: 'Iterable[tuple[str, int]]') -> None:
+    props = sorted(props)
+    drivers = sorted(drivers)
+    solution["owned_props"] = props
+    solution["owned_paths"] = [path for path, _ in drivers]
+    solution["owned_indices"] = [index for _, index in drivers]
+    # Swing aim vectors and their drivers are the only things other
+    # interpolators on the key can share, they're also kept on their own so
+    # reference counting only reads those
+    shared = [(path, index) for path, index in drivers if path.startswith(f'["{SWING_PREFIX}')]
+    solution["shared_props"] = [name for name in props if name.startswith(SWING_PREFIX)]
+    solution["shared_paths"] = [path for path, _ in shared]
+    solution["shared_indices"] = [index for _, index in shared]
+
+
+def shared_get(solution) -> 'tuple[list[str], list[tuple[str, int]]]':
+    if "shared_props" in solution:
+        return (list(solution["shared_props"]),
+                list(zip(solution["shared_paths"], solution["shared_indices"])))
+    # Bound before shared items were recorded
+    if "owned_props" in solution:
+        return ([name for name in solution["owned_props"] if name.startswith(SWING_PREFIX)],
+                [(path, index) for path, index in zip(solution["owned_paths"], solution["owned_indices"])
+                 if path.startswith(f'["{SWING_PREFIX}')])
+    return [], []
+
+
+def owned_driver_add(solution, path: str, index: int) -> None:
+    if "owned_paths" in solution:
+        solution["owned_paths"] = list(solution["owned_paths"]) + [path]
+        solution["owned_indices"] = list(solution["owned_indices"]) + [index]
+
+
+def owned_driver_remove(solution, path: str, index: int) -> None:
+    if "owned_paths" in solution:
+        drivers = list(zip(solution["owned_paths"], solution["owned_indices"]))
+        if (path, index) in drivers:
+            drivers.remove((path, index))
+            solution["owned_paths"] = [path for path, _ in drivers]
+            solution["owned_indices"] = [index for _, index in drivers]
+
+
+def shared_refcounts(key: 'Key', handle: str) -> 'Counter[str|tuple[str, int]]':
+    # How many of the key's other bound interpolators use each shared property
+    # and driver, those still in use by any are left in place
+    refcounts = Counter()
+    if key.is_property_set("pose_shape_interpolators"):
+        for psi in key.pose_shape_interpolators:
+            if psi.handle != handle:
+                solution = key.get(f'{psi.handle}.rbf')
+                if solution is not None:
+                    props, drivers = shared_get(solution)
+                    refcounts.update(props)
+                    refcounts.update(drivers)
+    return refcounts
+
+
+def unbind(psi: 'PoseShapeInterpolator', cache: 'DriverIndex|None' = None) -> None:
+    # Removes exactly what the last bind created, without scanning the key's
+    # other properties and drivers
+    evaluator_unregister(psi)
+    key = psi.id_data
+    props, drivers = owned_get(key, psi.handle)
+    refcounts = shared_refcounts(key, psi.handle)
+    props = [name for name in props if not refcounts[name]]
+    drivers = [path for path in drivers if not refcounts[path]]
+    if key.animation_data is not None:
+        # Shape keys may have been renamed since, which renames their drivers
+        drivers.extend(pose_driver_path(pose) for pose in psi.poses)
+        for path, index in drivers:
+            driver_remove(key, path, index, cache)
+    for name in props:
+        if name in key:
+            del key[name]
+    psi["is_bound"] = False
+
+
+def id_property_ensure(key: 'Key', propname: str, size: int) -> None:
+    value = key.get(propname)
+    if value is None or not hasattr(value, "__len__") or len(value) != size:
+        key[propname] = [0.0] * size
+
+
+class BindReport:
+
+    def __init__(self) -> None:
+        # FCurves added, changed or removed
+        self.touched = 0
+        self.warnings = []
+
+
+def input_settings(input_: 'PoseShapeInterpolatorInput') -> 'InputSettings':
+    return InputSettings(input_.object.name,
+                         input_.name,
+                         (input_.use_location_x, input_.use_location_y, input_.use_location_z),
+                         input_.use_rotation,
+                         input_.rotation_mode,
+                         input_.rotation_axis,
+                         (input_.use_scale_x, input_.use_scale_y, input_.use_scale_z))
+
+
+def pose_settings(pose: 'PoseShapeInterpolatorPose') -> 'PoseSettings':
+    return PoseSettings(pose.handle, pose.name, pose.range_min, pose.range_max, pose.use_clamp)
+
+
+def stored_solution(solution, count: int) -> 'Solution':
+    return Solution(np.array(solution["centers"], dtype=np.float64).reshape(count, -1),
+                    np.array(solution["scales"], dtype=np.float64),
+                    solution["kernel"],
+                    solution["radius"],
+                    solution.get("regularization", 0.0),
+                    weights_load(solution, count))
+
+
+def plan_request(psi: 'PoseShapeInterpolator') -> 'PlanRequest':
+    # Everything a bind reads from blender, as plain values
     inputs = read_inputs(psi)
     poses = read_poses(psi)
-    pose_data_matrix, input_data_matrix = read_data_matrices(poses)
-
-    layers = []
-
-    for input_, pose_data in zip(inputs, input_data_matrix):
-        flags = (
-            input_.use_location_x,
-            input_.use_location_y,
-            input_.use_location_z,
-        )
-        if any(flags):
-            vectors = list(zip(*[matrix.location for matrix in pose_data]))
-            for in_use, axis, vector in zip(flags, 'XYZ', vectors):
-                if not in_use:
-                    continue
-                # Template :
+    data_hash, solve_hash, digest = content_hash(psi)
+    # The last solution is kept if nothing it depends on has changed (and it
+    # was bound with the pose-space vector that pose drivers now read, and
+    # hasn't been updated incrementally since). Pose ranges and driver settings
+    # only change the drivers.
+    solution = psi.id_data.get(f'{psi.handle}.rbf')
+    if (psi.is_bound
+            and solution is not None
+            and solution.get("solve_hash") == solve_hash
+            and solution.get("vector")
+            and not solution.get("incremental")):
+        solution = stored_solution(solution, len(poses))
+    else:
+        solution = None
+    return PlanRequest(psi.handle,
+                       tuple(input_settings(inp) for inp in inputs),
+                       input_matrices(inputs, poses),
+                       tuple(pose_settings(pose) for pose in poses),
+                       psi.kernel,
+                       psi.radius,
+                       psi.use_sparse,
+                       regularization_get(psi),
+                       psi.driver_mode == 'SIMPLE',
+                       data_hash,
+                       solve_hash,
+                       digest,
+                       solution)
+
+
+def target_ids(psi: 'PoseShapeInterpolator') -> 'dict[str|None, ID]':
+    # The IDs planned driver targets refer to, by name (None for the key)
+    ids = {inp.object.name: inp.object for inp in psi.inputs if inp.object is not None}
+    ids[None] = psi.id_data
+    return ids
+
+
+def spec_resolve(spec: dict, ids: 'dict[str|None, ID]') -> dict:
+    return {**spec, "variables": [{
+        **var, "targets": [{**tgt, "id": ids[tgt["id"]]} for tgt in var["targets"]]
+    } for var in spec["variables"]]}
+
+
+def plan_apply(psi: 'PoseShapeInterpolator', plan: 'Plan', cache: 'DriverIndex|None' = None) -> 'BindReport':
+    # Only adds, changes or removes the drivers that differ from what is
+    # already there. Pass a cache to share driver lookups between binds on the
+    # same key.
+    key: 'Key' = psi.id_data
+    handle = plan.handle
+    report = BindReport()
+    report.warnings = list(plan.warnings)
+
+    owned_props, owned_drivers = owned_get(key, handle)
+    if plan.solved:
+        regularization_set(psi, plan.solution.regularization)
+        key[f'{handle}.rbf'] = plan.data
+    else:
+        key[f'{handle}.rbf'].update(plan.data)
+
+    for name, size in plan.props.items():
+        id_property_ensure(key, name, size)
+    props = {f'{handle}.rbf', *plan.props}
+    refcounts = shared_refcounts(key, handle)
+    for name in owned_props:
+        if name not in props and name in key and not refcounts[name]:
+            del key[name]
+    psi["is_bound"] = True
+    evaluator_register(psi)
+
+    ids = target_ids(psi)
+    graph = {path: spec_resolve(spec, ids) for path, spec in plan.specs.items()}
+    owned_drivers = [path for path in owned_drivers if not refcounts[path]]
+    report.touched = drivers_sync(key, graph, owned_drivers, cache)
+    owned_set(key[f'{handle}.rbf'], props, graph)
+    return report
+
+
+def bind(psi: 'PoseShapeInterpolator', cache: 'DriverIndex|None' = None) -> 'BindReport':
+    return plan_apply(psi, bind_plan(plan_request(psi)), cache)
+
+
+class BatchReport:
+
+    def __init__(self) -> None:
+        self.bound = 0
+        self.touched = 0
+        self.warnings = []
+        self.errors = []
+        # Seconds spent reading from blender, solving and writing drivers
+        self.read_time = 0.0
+        self.solve_time = 0.0
+        self.write_time = 0.0
+
+
+# Starting the pool took 0.3s in benchmarks/plan.py (each worker imports
+# numpy), and it's faster than planning in this process from twice that. It's
+# only used from 1s of estimated planning, as the estimate is rough.
+PARALLEL_MIN_SECONDS = 1.0
+
+# Planning time per pose and channel (reading the channels and writing the
+# driver specs) and per pose cubed (the solve), fitted on a single core by
+# benchmarks/plan.py
+PLAN_SECONDS_PER_CHANNEL = 2.6e-7
+PLAN_SECONDS_PER_SOLVE = 2.9e-10
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+
+
+def plan_seconds(request: 'PlanRequest') -> float:
+    # Rough estimate of the time bind_plan() takes, with at most four channels
+    # per input
+    inputs, poses = request.matrices.shape[:2]
+    seconds = PLAN_SECONDS_PER_CHANNEL * poses * inputs * 4
+    if request.solution is None:
+        seconds += PLAN_SECONDS_PER_SOLVE * poses ** 3
+    return seconds
+
+
+def _plan_serial(request: 'PlanRequest') -> 'Plan|Exception':
+    try:
+        return bind_plan(request)
+    except Exception as error:
+        return error
+
+
+def _plan_result(future: 'Future') -> 'Plan|Exception':
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        raise
+    except Exception as error:
+        return error
+
+
+def bind_plans(requests: 'list[PlanRequest]', processes: 'int|None' = None) -> 'list[Plan|Exception]':
+    # Plans are independent of each other, so with enough work they're made
+    # in a pool of processes (all cores by default). The results are in the
+    # same order as the requests, with the error in place of any plan that
+    # failed. Planning falls back to this process if the pool can't be used.
+    processes = min(len(requests), processes or os.cpu_count() or 1)
+    if processes > 1 and sum(plan_seconds(request) for request in requests) >= PARALLEL_MIN_SECONDS:
+        try:
+            with ProcessPoolExecutor(processes,
+                                     mp_context=get_context('spawn'),
+                                     initializer=run_path,
+                                     initargs=(WORKER_PATH, {"PACKAGE": __package__})) as pool:
+                futures = [pool.submit(bind_plan, request) for request in requests]
+                return [_plan_result(future) for future in futures]
+        except (BrokenProcessPool, OSError):
+            pass
+    return [_plan_serial(request) for request in requests]
+
+
+def bind_all(keys: 'Iterable[Key]|None' = None, processes: 'int|None' = None) -> 'BatchReport':
+    # Binds every interpolator on every key (all shape keys in the file by
+    # default). All of them are read and planned (see bind_plans) before any
+    # are written.
+    if keys is None:
+        keys = bpy.data.shape_keys
+    report = BatchReport()
+
+    start = perf_counter()
+    requests = []
+    for key in keys:
+        if not key.is_property_set("pose_shape_interpolators"):
+            continue
+        for psi in key.pose_shape_interpolators:
+            try:
+                requests.append((psi, plan_request(psi)))
+            except RuntimeError as error:
+                report.errors.append(f'{key.name}: {psi.name}: {error}')
+    report.read_time = perf_counter() - start
+
+    start = perf_counter()
+    plans = []
+    results = bind_plans([request for _, request in requests], processes)
+    for (psi, _), result in zip(requests, results):
+        if isinstance(result, Exception):
+            report.errors.append(f'{psi.id_data.name}: {psi.name}: {result}')
+        else:
+            plans.append((psi, result))
+    report.solve_time = perf_counter() - start
+
+    start = perf_counter()
+    caches = {}
+    for psi, plan in plans:
+        key = psi.id_data
+        cache = caches.get(key.as_pointer())
+        if cache is None:
+            cache = caches[key.as_pointer()] = DriverIndex(key)
+        result = plan_apply(psi, plan, cache)
+        report.bound += 1
+        report.touched += result.touched
+        report.warnings.extend(f'{key.name}: {psi.name}: {message}' for message in result.warnings)
+    report.write_time = perf_counter() - start
+    return report
+
+
+def update_kernel(psi: 'PoseShapeInterpolator') -> 'BindReport':
+    key: 'Key' = psi.id_data
+    handle = psi.handle
+    solution = key.get(f'{handle}.rbf')
+    if solution is None:
+        return BindReport()
+    # Simple expressions have the kernel and weights baked in, so they need
+    # rewriting from scratch, as does a solution the inputs or poses have
+    # changed since
+    data_hash, solve_hash, _ = content_hash(psi)
+    if psi.driver_mode == 'SIMPLE' or solution.get("data_hash") != data_hash:
+        return bind(psi)
+    count = len(solution["range_min"])
+    data = np.array(solution["centers"], dtype=np.float64).reshape(count, -1)
+    kernel = psi.kernel
+    report = BindReport()
+    weights, radius, regularization, warnings = solve_weights(handle, data, kernel, psi.radius,
+                                                              psi.use_sparse, regularization_get(psi))
+    report.warnings = list(warnings)
+    regularization_set(psi, regularization)
+    weights_store(solution, weights)
+    solution["kernel"] = kernel
+    solution["radius"] = radius
+    solution["regularization"] = regularization
+    solution["solve_hash"] = solve_hash
+    evaluator_register(psi)
+    return report
+
+
+def pose_space_vector(psi: 'PoseShapeInterpolator') -> 'np.ndarray':
+    # The current rig state in the normalized pose space of the last bind
+    solution = psi.id_data.get(f'{psi.handle}.rbf')
+    if solution is None:
+        raise RuntimeError(f'{psi.name} is not bound')
+    inputs = read_inputs(psi)
+    table = ChannelTable([input_settings(inp) for inp in inputs],
+                         psi.inputs.matrices_resolve(inputs)[:, np.newaxis])
+    vec = table.posedata[0]
+    scales = np.array(solution["scales"], dtype=np.float64)
+    if vec.shape != scales.shape:
+        raise RuntimeError(f'{psi.name} inputs have changed since it was bound')
+    return vec / scales
+
+
+def _pose_query(psi: 'PoseShapeInterpolator',
+                distances: 'np.ndarray',
+                indices: 'np.ndarray') -> 'list[tuple[PoseShapeInterpolatorPose, float]]':
+    handles = list(psi.id_data[f'{psi.handle}.rbf']["poses"])
+    poses = {pose.handle: pose for pose in psi.poses}
+    result = []
+    for distance, index in zip(distances.tolist(), indices.tolist()):
+        pose = poses.get(handles[index])
+        if pose is not None:
+            result.append((pose, distance))
+    return result
+
+
+def _pose_centers(psi: 'PoseShapeInterpolator') -> 'np.ndarray':
+    solution = psi.id_data[f'{psi.handle}.rbf']
+    count = len(solution["range_min"])
+    return np.array(solution["centers"], dtype=np.float64).reshape(count, -1)
+
+
+def nearest_poses(psi: 'PoseShapeInterpolator',
+                  count: int = 1) -> 'list[tuple[PoseShapeInterpolatorPose, float]]':
+    # Ranked by pose_distances(), which measures swing and twist rotations by
+    # the geodesic angle between them, so by brute force over the pose data
+    solution = psi.id_data.get(f'{psi.handle}.rbf')
+    if solution is None:
+        raise RuntimeError(f'{psi.name} is not bound')
+    inputs = read_inputs(psi)
+    poses = read_poses(psi)
+    distances = pose_distances([input_settings(inp) for inp in inputs],
+                               input_matrices(inputs, poses),
+                               psi.inputs.matrices_resolve(inputs),
+                               np.array(solution["scales"], dtype=np.float64))
+    order = np.argsort(distances)[:count]
+    return [(poses[index], float(distances[index])) for index in order.tolist()]
+
+
+def poses_within(psi: 'PoseShapeInterpolator',
+                 radius: float = 0.0) -> 'list[tuple[PoseShapeInterpolatorPose, float]]':
+    # Defaults to the kernel radius, i.e. the poses a compact kernel would use
+    vec = pose_space_vector(psi)
+    tree = pose_tree(psi.handle, _pose_centers(psi))
+    distances, indices = tree.query_radius(vec, radius or psi.id_data[f'{psi.handle}.rbf']["radius"])
+    order = np.argsort(distances)
+    return _pose_query(psi, distances[order], indices[order])
+
+
+# Incremental updates keep the channel scales, kernel radius and regularization
+# of the last full bind fixed, so that only the changed pose's row/column of the
+# kernel matrix changes and the stored inverse can be updated in O(n^2).
+
+def _incremental_solution(psi: 'PoseShapeInterpolator') -> 'tuple|None':
+    key: 'Key' = psi.id_data
+    handle = psi.handle
+    solution = key.get(f'{handle}.rbf')
+    if solution is None:
+        return None
+    count = len(solution["range_min"])
+    data = np.array(solution["centers"], dtype=np.float64).reshape(count, -1)
+    # Sparse weights are an approximate inverse, and solutions from before pose
+    # drivers read the pose-space vector (through self) have different
+    # drivers, so both are always re-solved
+    if "weights_indptr" in solution or not solution.get("vector") or not solution.get("use_self"):
+        return solution, data, None
+    weights = np.array(solution["weights"], dtype=np.float64).reshape(count, count)
+    return solution, data, weights
+
+
+def _incremental_vector(psi: 'PoseShapeInterpolator',
+                        pose: 'PoseShapeInterpolatorPose',
+                        solution, data: 'np.ndarray') -> 'np.ndarray|None':
+    inputs = read_inputs(psi)
+    table = ChannelTable([input_settings(inp) for inp in inputs],
+                         input_matrices(inputs, [pose]))
+    vec = table.posedata[0]
+    if vec.shape[0] != data.shape[1]:
+        return None
+    return vec / np.array(solution["scales"], dtype=np.float64)
+
+
+def _incremental_column(solution, data: 'np.ndarray', vec: 'np.ndarray') -> 'tuple[np.ndarray, float]':
+    function = KERNELS[solution["kernel"]].function
+    radius = solution["radius"]
+    delta = data - vec
+    column = function(np.sqrt(np.einsum('ij,ij->i', delta, delta)), radius)
+    diagonal = float(function(np.zeros(1), radius)[0]) + solution.get("regularization", 0.0)
+    return column, diagonal
+
+
+def _incremental_store(psi: 'PoseShapeInterpolator',
+                       solution,
+                       data: 'np.ndarray',
+                       weights: 'np.ndarray',
+                       removed: 'PoseShapeInterpolatorPose|None' = None) -> None:
+    solution["data_hash"], solution["solve_hash"], solution["hash"] = content_hash(psi, removed)
+    # The channel scales and radius are still those of the poses it was bound
+    # with, so the next bind solves from scratch rather than reusing it
+    solution["incremental"] = 1
+    solution["centers"] = data.ravel().tolist()
+    solution["weights"] = weights.ravel().tolist()
+    DISTANCE_CACHE.pop(psi.handle, None)
+    evaluator_register(psi)
+
+
+def _incremental_expressions(psi: 'PoseShapeInterpolator', solution) -> None:
+    key: 'Key' = psi.id_data
+    handles = list(solution["poses"])
+    for pose in psi.poses:
+        handle = pose.handle
+        if handle not in handles:
+            continue
+        fc = driver_find(key, f'key_blocks["{pose.name}"].value')
+        if fc is not None:
+            fc.driver.expression = python_expression(psi.handle, handles.index(handle))
+
+
+def pose_add(psi: 'PoseShapeInterpolator', pose: 'PoseShapeInterpolatorPose') -> None:
+    incremental = _incremental_solution(psi)
+    if incremental is None:
+        return
+    solution, data, weights = incremental
+    if psi.driver_mode == 'SIMPLE' or weights is None:
+        bind(psi)
+        return
+    vec = _incremental_vector(psi, pose, solution, data)
+    if vec is None:
+        bind(psi)
+        return
+    column, diagonal = _incremental_column(solution, data, vec)
+    weights = inverse_append(weights, column, diagonal)
+    data = np.vstack((data, vec))
+
+    for name, value in (("range_min", pose.range_min),
+                        ("range_max", pose.range_max),
+                        ("use_clamp", int(pose.use_clamp)),
+                        ("poses", pose.handle)):
+        solution[name] = list(solution[name]) + [value]
+    _incremental_store(psi, solution, data, weights)
+
+    path, index = pose_driver_path(pose)
+    spec = python_driver_spec(psi.handle, python_expression(psi.handle, data.shape[0] - 1))
+    driver_update(driver_ensure(psi.id_data, path, index), spec_resolve(spec, target_ids(psi)))
+    owned_driver_add(solution, path, index)
+
+
+def pose_remove(psi: 'PoseShapeInterpolator', pose: 'PoseShapeInterpolatorPose') -> bool:
+    # Called before the pose is removed. Returns False if the interpolator
+    # needs a full rebind once it has been.
+    incremental = _incremental_solution(psi)
+    if incremental is None:
+        return True
+    solution, data, weights = incremental
+    handles = list(solution["poses"])
+    if pose.handle not in handles:
+        return True
+    index = handles.index(pose.handle)
+    path, array_index = pose_driver_path(pose)
+    fc = driver_find(psi.id_data, path, array_index)
+    if fc is not None:
+        fc.id_data.animation_data.drivers.remove(fc)
+    owned_driver_remove(solution, path, array_index)
+    if psi.driver_mode == 'SIMPLE' or weights is None or data.shape[0] <= 2:
+        return False
+    weights = inverse_remove(weights, index)
+    data = np.delete(data, index, 0)
+
+    for name in ("range_min", "range_max", "use_clamp", "poses"):
+        values = list(solution[name])
+        del values[index]
+        solution[name] = values
+    _incremental_store(psi, solution, data, weights, removed=pose)
+
+    _incremental_expressions(psi, solution)
+    return True
+
+
+def pose_update(psi: 'PoseShapeInterpolator', pose: 'PoseShapeInterpolatorPose') -> bool:
+    # Called after the pose has changed. Returns False if the interpolator
+    # needs a full rebind (simple expressions and sparse weights can't be
+    # updated incrementally).
+    incremental = _incremental_solution(psi)
+    if incremental is None:
+        return True
+    solution, data, weights = incremental
+    handles = list(solution["poses"])
+    if pose.handle not in handles or psi.driver_mode == 'SIMPLE' or weights is None:
+        return False
+    vec = _incremental_vector(psi, pose, solution, data)
+    if vec is None:
+        return False
+    index = handles.index(pose.handle)
+    count = data.shape[0]
+
+    # Downdate the old pose, append the new one then permute it back into place
+    weights = inverse_remove(weights, index)
+    data = np.delete(data, index, 0)
+    column, diagonal = _incremental_column(solution, data, vec)
+    weights = inverse_append(weights, column, diagonal)
+    data = np.vstack((data, vec))
+    order = np.r_[0:index, count - 1, index:count - 1]
+    weights = weights[np.ix_(order, order)]
+    data = data[order]
+
+    for name, value in (("range_min", pose.range_min),
+                        ("range_max", pose.range_max),
+                        ("use_clamp", int(pose.use_clamp))):
+        values = list(solution[name])
+        values[index] = value
+        solution[name] = values
+    _incremental_store(psi, solution, data, weights)
+    return True
+
+
+# Poses edited through their transform properties (e.g. by dragging a slider)
+# that need a full rebind are rebound once they've gone unedited for this many
+# seconds, rather than on every change
+REBIND_DELAY = 0.5
+
+# (key name, interpolator handle) -> time of the last edit
+REBIND_PENDING: 'dict[tuple[str, str], float]' = {}
+
+
+def rebind_deferred(psi: 'PoseShapeInterpolator') -> None:
+    REBIND_PENDING[(psi.id_data.name, psi.handle)] = perf_counter()
+    if not bpy.app.timers.is_registered(_rebind_pending):
+        bpy.app.timers.register(_rebind_pending, first_interval=REBIND_DELAY)
+
+
+def _rebind_pending() -> 'float|None':
+    now = perf_counter()
+    for item, time in list(REBIND_PENDING.items()):
+        if now - time < REBIND_DELAY:
+            continue
+        del REBIND_PENDING[item]
+        name, handle = item
+        key = bpy.data.shape_keys.get(name)
+        if key is None or not key.is_property_set("pose_shape_interpolators"):
+            continue
+        psi = next((psi for psi in key.pose_shape_interpolators if psi.handle == handle), None)
+        if psi is not None and psi.is_bound:
+            try:
+                bind(psi)
+            except RuntimeError:
+                # Left bound to the last solution, the error is reported by
+                # the next bind from the interface
+                pass
+    if not REBIND_PENDING:
+        return None
+    return max(REBIND_DELAY - (now - min(REBIND_PENDING.values())), 0.0)
+
+
+def unregister() -> None:
+    REBIND_PENDING.clear()
+    if bpy.app.timers.is_registered(_rebind_pending):
+        bpy.app.timers.unregister(_rebind_pending)
@@ -1,6 +1,9 @@
 
 from uuid import uuid4
 from typing import TYPE_CHECKING
+import numpy as np
+import bpy
+from bpy.app.handlers import persistent
 from bpy.types import Object, PoseBone, PropertyGroup, ShaderNodeTree, ShapeKey
 from bpy.props import (
     BoolProperty,
@@ -14,9 +17,21 @@ from bpy.props import (
     )
 from mathutils import Euler, Matrix, Quaternion, Vector
 from .ipo import InterpolationSettings, curve_mapping_tree_get, curve_mapping_tree_ensure
+from .kernels import KERNELS
+from .utils import (
+    DriverIndex,
+    ik_chain_bones,
+    input_name_find,
+    input_name_index,
+    input_name_invalidate,
+    lookup_indices_clear,
+    pose_data_find,
+    pose_data_invalidate
+    )
 if TYPE_CHECKING:
-    from typing import Iterable, Iterator
+    from typing import Iterable, Iterator, Sequence
     from bpy.types import Context
+    from .rbf import BatchReport, BindReport
 
 __all__ = (
     "PoseShapeInterpolatorInput",
@@ -65,14 +80,18 @@ class PoseShapeInterpolatorInput(PropertyGroup):
         if o is None:
             return tuple()
         s = set(o.data.bones.keys())
-        for x in self.id_data.pose_shape_interpolator_settings:
-            if x.object != o:
-                continue
-            for i in x.inputs:
-                if i != self:
-                    s.discard(i.name)
+        for psi in self.id_data.pose_shape_interpolators:
+            inputs = psi.inputs
+            items = inputs.internal__
+            for name, indices in input_name_index(inputs, items).items():
+                if name in s and any(items[i].object == o and items[i] != self for i in indices):
+                    s.discard(name)
         return s
 
+    def _name_update(self, context: 'Context') -> None:
+        path: str = self.path_from_id()
+        input_name_invalidate(self.id_data.path_resolve(path[:path.rfind(".internal__")]))
+
     def _object_poll(self, object_: 'Object') -> bool:
         return object_.type == 'ARMATURE'
 
@@ -87,7 +106,7 @@ class PoseShapeInterpolatorInput(PropertyGroup):
         name="Enabled",
         description="True if any input channels are in use (read-only)",
         get=_is_enabled,
-        optinos=set()
+        options=set()
         )# type: ignore
 
     is_valid: BoolProperty(
@@ -101,6 +120,7 @@ class PoseShapeInterpolatorInput(PropertyGroup):
         name="Name",
         description="The name of the pose bone to use as input",
         search=_name_search,
+        update=_name_update,
         options=set()
         )# type: ignore
 
@@ -206,10 +226,7 @@ class PoseShapeInterpolatorInput(PropertyGroup):
 class PoseShapeInterpolatorInputs(PropertyGroup):
 
     def __contains__(self, name: str) -> bool:
-        for input_ in self:
-            if input_.name == name:
-                return True
-        return False
+        return input_name_find(self, self.internal__, name) != -1
 
     def __len__(self) -> int:
         return len(self.internal__)
@@ -245,16 +262,15 @@ class PoseShapeInterpolatorInputs(PropertyGroup):
         psi = self.id_data.path_resolve(path[:path.rfind(".")])
         for pose in psi.poses:
             pose.data._clear()
+        input_name_invalidate(self)
         self.internal__.clear()
 
     def find(self, name: str) -> int:
-        return next((i for i, x in enumerate(self) if x.name == name), -1)
+        return input_name_find(self, self.internal__, name)
 
     def get(self, name: str, fallback: object = None) -> object:
-        for input_ in self:
-            if input_.name == name:
-                return input_
-        return fallback
+        index = input_name_find(self, self.internal__, name)
+        return fallback if index == -1 else self.internal__[index]
 
     def keys(self) -> 'Iterator[str]':
         for input_ in self:
@@ -264,11 +280,50 @@ class PoseShapeInterpolatorInputs(PropertyGroup):
         for input_ in self:
             yield input_.name, input_
 
+    def matrices_resolve(self,
+            inputs: 'Sequence[PoseShapeInterpolatorInput]|None' = None) -> 'np.ndarray':
+        # Batched PoseShapeInterpolatorInput.matrix_resolve(), (N, 4, 4). The
+        # local matrix of a bone without constraints is its matrix_basis, so
+        # those are read with one foreach_get per armature and only
+        # constrained bones, or bones an IK chain solves, are converted one
+        # by one.
+        if inputs is None:
+            inputs = list(self)
+        matrices = np.empty((len(inputs), 4, 4), dtype=np.float64)
+        matrices[:] = np.identity(4)
+        armatures: 'dict[Object, list[int]]' = {}
+        for index, input_ in enumerate(inputs):
+            ob = input_.object
+            if ob is not None and ob.type == 'ARMATURE':
+                armatures.setdefault(ob, []).append(index)
+        for ob, indices in armatures.items():
+            bones = ob.pose.bones
+            buffer = np.empty(len(bones) * 16, dtype=np.float32)
+            bones.foreach_get("matrix_basis", buffer)
+            # Matrix properties are stored column major
+            basis = buffer.reshape(-1, 4, 4).transpose(0, 2, 1)
+            solved = ik_chain_bones(bones)
+            for index in indices:
+                input_ = inputs[index]
+                bone = bones.find(input_.name)
+                if bone == -1:
+                    continue
+                if len(bones[bone].constraints) or input_.name in solved:
+                    matrices[index] = input_.matrix_resolve()
+                else:
+                    matrices[index] = basis[bone]
+        return matrices
+
+    def move(self, from_index: int, to_index: int) -> None:
+        input_name_invalidate(self)
+        self.internal__.move(from_index, to_index)
+
     def new(self, pose_bone: 'PoseBone|None' = None) -> 'PoseShapeInterpolatorInput':
         if pose_bone is not None and not isinstance(pose_bone, PoseBone):
             raise TypeError((f'PoseShapeInterpolatorInputs.new(pose_bone): '
                              f'Expected pose_bone to be None or PoseBone, '
                              f'not {type(pose_bone)}'))
+        input_name_invalidate(self)
         input_ = self.internal__.add()
         input_._init("" if pose_bone is None else pose_bone)
         path = self.path_from_id()
@@ -290,10 +345,15 @@ class PoseShapeInterpolatorInputs(PropertyGroup):
         psi = self.id_data.path_resolve(path[:path.rfind(".")])
         for pose in psi.poses:
             pose.data._remove(input)
+        input_name_invalidate(self)
         self.internal__.remove(index)
         self.active_index = min(self.active_index, len(self) -1)
 
 
+# Pointer of an input pose -> (its matrix, location, quaternion, euler, scale)
+INPUT_POSE_TRS: 'dict[int, tuple[Matrix, Vector, Quaternion, Euler, Vector]]' = {}
+
+
 class PoseShapeInterpolatorInputPose(PropertyGroup):
 
     def _init(self, input_: 'PoseShapeInterpolatorInput') -> None:
@@ -306,56 +366,76 @@ class PoseShapeInterpolatorInputPose(PropertyGroup):
     def _input_handle_set(self, value: str) -> None:
         self["input_handle"] = value
 
+    def _decompose(self) -> 'tuple[Vector, Quaternion, Euler, Vector]':
+        # The matrix's location, rotation and scale, worked out once for as
+        # long as the matrix stays the same (drawing reads all three)
+        matrix = self.matrix.copy()
+        key = self.as_pointer()
+        cached = INPUT_POSE_TRS.get(key)
+        if cached is None or cached[0] != matrix:
+            cached = INPUT_POSE_TRS[key] = (
+                matrix,
+                matrix.to_translation(),
+                matrix.to_quaternion(),
+                matrix.to_euler(),
+                matrix.to_scale()
+            )
+        return cached[1:]
+
     def _location_get(self) -> 'Vector':
-        return self.matrix.to_translation()
+        return self._decompose()[0]
 
     def _location_set(self, value: tuple[float, float, float]) -> None:
-        self.matrix = Matrix.LocRotScale(
-            value,
-            self._rotation_quaternion_get(),
-            self._scale_get()
-        )
+        _, rotation, _, scale = self._decompose()
+        self.matrix = Matrix.LocRotScale(value, rotation, scale)
+        self._pose_update()
+
+    def _pose_update(self) -> None:
+        path: str = self.path_from_id()
+        psi = self.id_data.path_resolve(path[:path.rfind(".poses")])
+        if psi.is_bound:
+            # Runs on every change while a slider is dragged, so anything more
+            # than an incremental update waits until the dragging stops
+            from .rbf import pose_update, rebind_deferred
+            if not pose_update(psi, self.id_data.path_resolve(path[:path.rfind(".data")])):
+                rebind_deferred(psi)
 
     def _rotation_axis_angle_get(self) -> 'Vector':
-        axis, angle = self._rotation_quaternion_get().to_axis_angle()
+        axis, angle = self._decompose()[1].to_axis_angle()
         return Vector((angle, axis[0], axis[1], axis[2]))
 
     def _rotation_axis_angle_set(self, value: tuple[float, float, float, float]) -> None:
+        location, _, _, scale = self._decompose()
         self.matrix = Matrix.LocRotScale(
-            self._location_get(),
+            location,
             Quaternion((value[1], value[2], value[3]), value[0]),
-            self._scale_get()
+            scale
         )
+        self._pose_update()
 
     def _rotation_euler_get(self) -> 'Euler':
-        return self.matrix.to_euler()
+        return self._decompose()[2]
 
     def _rotation_euler_set(self, value: tuple[float, float, float]) -> None:
-        self.matrix = Matrix.LocRotScale(
-            self._location_get(),
-            Euler(value).to_quaternion(),
-            self._scale_get()
-        )
+        location, _, _, scale = self._decompose()
+        self.matrix = Matrix.LocRotScale(location, Euler(value).to_quaternion(), scale)
+        self._pose_update()
 
     def _rotation_quaternion_get(self) -> 'Quaternion':
-        return self.matrix.to_quaternion()
+        return self._decompose()[1]
 
     def _rotation_quaternion_set(self, value: tuple[float, float, float, float]) -> None:
-        self.matrix = Matrix.LocRotScale(
-            self._location_get(),
-            Quaternion(value),
-            self._scale_get()
-        )
+        location, _, _, scale = self._decompose()
+        self.matrix = Matrix.LocRotScale(location, Quaternion(value), scale)
+        self._pose_update()
 
     def _scale_get(self) -> 'Vector':
-        return self.matrix.to_scale()
+        return self._decompose()[3]
 
     def _scale_set(self, value: tuple[float, float, float]) -> None:
-        self.matrix = Matrix.LocRotScale(
-            self._location_get(),
-            self._rotation_quaternion_get(),
-            value
-        )
+        location, rotation, _, _ = self._decompose()
+        self.matrix = Matrix.LocRotScale(location, rotation, value)
+        self._pose_update()
 
     def _update(self, input_: 'PoseShapeInterpolatorInput') -> None:
         self.matrix = input_.matrix_resolve()
@@ -426,18 +506,43 @@ class PoseShapeInterpolatorInputPose(PropertyGroup):
 class PoseShapeInterpolatorPoseData(PropertyGroup):
 
     def _add(self, input_: 'PoseShapeInterpolatorInput') -> None:
+        pose_data_invalidate(self)
         self.internal__.add()._init(input_)
 
+    def _add_all(self,
+            inputs: 'Sequence[PoseShapeInterpolatorInput]',
+            matrices: 'np.ndarray') -> None:
+        pose_data_invalidate(self)
+        items = self.internal__
+        for input_ in inputs:
+            items.add()._input_handle_set(input_.handle)
+        self._update_all(inputs, matrices)
+
     def _clear(self) -> None:
+        pose_data_invalidate(self)
         self.internal__.clear()
 
     def _remove(self, input_: 'PoseShapeInterpolatorInput') -> None:
-        data = self.internal__
-        handle = input_.handle
-        for i, x in enumerate(data):
-            if x.input_handle == handle:
-                data.remove(i)
-                return
+        index = pose_data_find(self, self.internal__, input_.handle)
+        if index != -1:
+            pose_data_invalidate(self)
+            self.internal__.remove(index)
+
+    def _update_all(self,
+            inputs: 'Sequence[PoseShapeInterpolatorInput]',
+            matrices: 'np.ndarray') -> None:
+        # Writes the (N, 4, 4) matrices of inputs to their items with a single
+        # foreach_set, leaving the items of any other inputs as they are
+        items = self.internal__
+        buffer = np.empty(len(items) * 16, dtype=np.float32)
+        items.foreach_get("matrix", buffer)
+        values = buffer.reshape(-1, 4, 4)
+        for input_, matrix in zip(inputs, matrices):
+            index = pose_data_find(self, items, input_.handle)
+            if index != -1:
+                # Matrix properties are stored column major
+                values[index] = matrix.T
+        items.foreach_set("matrix", buffer)
 
     internal__: CollectionProperty(
         type=PoseShapeInterpolatorInputPose,
@@ -449,22 +554,27 @@ class PoseShapeInterpolatorPoseData(PropertyGroup):
             raise TypeError((f'PoseShapeInterpolatorPoseData.get(input): '
                              f'Expected input to be PoseShapeInterpolatorInput, '
                              f'not {type(input)}'))
-        handle = input.handle
-        for item in self.internal__:
-            if item._input_handle_get() == handle:
-                return item
+        index = pose_data_find(self, self.internal__, input.handle)
+        if index != -1:
+            return self.internal__[index]
 
 
 class PoseShapeInterpolatorPose(InterpolationSettings):
 
+    def _handle_get(self) -> str:
+        handle = self.get("handle", "")
+        if not handle:
+            handle = str(uuid4())
+            self["handle"] = handle
+        return handle
+
     def _init(self, name: str) -> None:
         self["name"] = name
         self._init_interpolation_settings()
-        data = self.data
         path = self.path_from_id()
         psi = self.id_data.path_resolve(path[:path.rfind(".poses")])
-        for input_ in psi.inputs:
-            data._add(input_)
+        inputs = list(psi.inputs)
+        self.data._add_all(inputs, psi.inputs.matrices_resolve(inputs))
 
     def _is_valid_get(self) -> bool:
         return self.resolve() is not None
@@ -487,13 +597,9 @@ class PoseShapeInterpolatorPose(InterpolationSettings):
             for pose in psi.poses:
                 if pose != self:
                     used.add(pose.name)
-        ad = key.animation_data
-        if ad is not None:
-            for fc in ad.drivers:
-                dp: str = fc.data_path
-                if dp.startswith('key_blocks["') and dp.endswith('.value'):
-                    used.add(dp[12:-6])
-        return tuple(k for k in key.key_blocks.keys() if k not in used)
+        drivers = DriverIndex(key)
+        return tuple(k for k in key.key_blocks.keys()
+                     if k not in used and (f'key_blocks["{k}"].value', 0) not in drivers)
 
     data: PointerProperty(
         name="Data",
@@ -502,6 +608,13 @@ class PoseShapeInterpolatorPose(InterpolationSettings):
         options=set()
         )# type: ignore
 
+    handle: StringProperty(
+        name="Handle",
+        description="Unique pose identifier (read-only)",
+        get=_handle_get,
+        options={'HIDDEN'}
+        )# type: ignore
+
     is_valid: BoolProperty(
         name="Valid",
         description="True if a shape key exists for this pose",
@@ -551,6 +664,16 @@ class PoseShapeInterpolatorPose(InterpolationSettings):
     def resolve(self) -> 'ShapeKey|None':
         return self.id_data.key_blocks.get(self.name)
 
+    def update(self) -> None:
+        path = self.path_from_id()
+        psi = self.id_data.path_resolve(path[:path.rfind(".poses")])
+        inputs = list(psi.inputs)
+        self.data._update_all(inputs, psi.inputs.matrices_resolve(inputs))
+        if psi.is_bound:
+            from .rbf import pose_update
+            if not pose_update(psi, self):
+                psi.bind()
+
 
 class PoseShapeInterpolatorPoses(PropertyGroup):
 
@@ -610,11 +733,19 @@ class PoseShapeInterpolatorPoses(PropertyGroup):
             raise TypeError((f'PoseShapeInterpolatorPoses.new(name): '
                              f'Expected name to be str, not {type(name)}'))
         psi = self._root_resolve()
-        if psi.is_bound:
+        if psi.is_bound and self.id_data.key_blocks.get(name) is None:
             raise RuntimeError((f'PoseShapeInterpolatorPoses.new(name): '
-                                f'Cannot add new poses to bound interpolator'))
+                                f'Poses added to a bound interpolator require a shape key'))
         pose = self.internal__.add()
         pose._init(name)
+        if psi.is_bound:
+            from .rbf import pose_add
+            try:
+                pose_add(psi, pose)
+            except RuntimeError:
+                # Not part of the solution and without a driver, so it goes
+                self.internal__.remove(len(self) - 1)
+                raise
         self.active_index = len(self) - 1
         return pose
 
@@ -626,8 +757,18 @@ class PoseShapeInterpolatorPoses(PropertyGroup):
         if index == -1:
             raise ValueError((f'PoseShapeInterpolatorPoses.remove(pose): '
                               f'{pose} is not a member of this collection'))
+        psi = self._root_resolve()
+        rebind = False
+        if psi.is_bound:
+            from .rbf import pose_remove
+            rebind = not pose_remove(psi, pose)
         self.internal__.remove(index)
         self.active_index = min(self.active_index, len(self)-1)
+        if rebind:
+            try:
+                psi.bind()
+            except RuntimeError:
+                psi.unbind()
 
 
 class PoseShapeInterpolator(InterpolationSettings):
@@ -642,6 +783,11 @@ class PoseShapeInterpolator(InterpolationSettings):
     def _is_bound(self) -> bool:
         return self.get("is_bound", False)
 
+    def _kernel_update(self, context: 'Context') -> None:
+        if self.is_bound:
+            from .rbf import update_kernel
+            update_kernel(self)
+
     handle: StringProperty(
         name="Handle",
         description="Unique pose shape interpolator identifier (read-only)",
@@ -649,6 +795,19 @@ class PoseShapeInterpolator(InterpolationSettings):
         options={'HIDDEN'}
         )# type: ignore
 
+    driver_mode: EnumProperty(
+        name="Drivers",
+        description="How the pose shape key drivers are evaluated",
+        items=[
+            ('PYTHON', "Python", "Evaluate every pose in a single python function call"),
+            ('SIMPLE', "Simple Expressions", ("Use only simple driver expressions, which Blender "
+                                              "evaluates without python (falls back to python for "
+                                              "expressions that are too long)")),
+        ],
+        default='PYTHON',
+        options=set()
+        )# type: ignore
+
     inputs: PointerProperty(
         name="Inputs",
         description="Pose shape interpolator inputs",
@@ -663,6 +822,15 @@ class PoseShapeInterpolator(InterpolationSettings):
         options=set()
         )# type: ignore
 
+    kernel: EnumProperty(
+        name="Kernel",
+        description="Radial basis function used to interpolate between poses",
+        items=[(k, v.name, v.description) for k, v in KERNELS.items()],
+        default='GAUSSIAN',
+        options=set(),
+        update=_kernel_update
+        )# type: ignore
+
     poses: PointerProperty(
         name="Poses",
         description="Interpolated poses",
@@ -670,32 +838,60 @@ class PoseShapeInterpolator(InterpolationSettings):
         options=set()
         )# type: ignore
 
-    def bind(self) -> None:
-        pass
+    radius: FloatProperty(
+        name="Radius",
+        description="Kernel width (zero uses the mean distance between poses)",
+        min=0.0,
+        default=0.0,
+        precision=3,
+        options=set(),
+        update=_kernel_update
+        )# type: ignore
+
+    regularization: FloatProperty(
+        name="Smoothing",
+        description=("Added to the kernel matrix diagonal, trading exact interpolation of the poses "
+                     "for stability when poses are close together"),
+        min=0.0,
+        default=0.0,
+        precision=6,
+        options=set(),
+        update=_kernel_update
+        )# type: ignore
+
+    use_auto_regularization: BoolProperty(
+        name="Auto",
+        description="Choose the smoothing with the lowest leave-one-out error when binding",
+        default=False,
+        options=set(),
+        update=_kernel_update
+        )# type: ignore
+
+    use_sparse: BoolProperty(
+        name="Sparse",
+        description=("Solve and store the weights sparsely, so that only the poses within the "
+                     "kernel radius are evaluated (compactly supported kernels only, for large "
+                     "numbers of poses)"),
+        default=False,
+        options=set(),
+        update=_kernel_update
+        )# type: ignore
+
+    def bind(self) -> 'BindReport':
+        from .rbf import bind
+        return bind(self)
 
     def unbind(self) -> None:
-        # TODO remove idprops and idprop drivers
-        key = self.id_data
-        pfx = self.handle
-        for k in key.keys():
-            if k.startswith(pfx):
-                del key[k]
-        ad = key.animation_data
-        if ad is None:
-            return
-        fx = ad.drivers
-        for pose in self.poses:
-            kb = pose.resolve()
-            if kb is None:
-                continue
-            fc = fx.find(f'key_blocks["{kb.name}"].value')
-            if fc is not None:
-                fx.remove(fc)
-        pfx = f'["{pfx}'
-        for fc in reversed(tuple(fx)):
-            dp = fc.data_path
-            if dp.startsith(pfx):
-                fx.remove(fc)
+        from .rbf import unbind
+        unbind(self)
+
+    def nearest_poses(self, count: int = 1) -> 'list[tuple[PoseShapeInterpolatorPose, float]]':
+        from .rbf import nearest_poses
+        return nearest_poses(self, count)
+
+    def poses_within(self, radius: float = 0.0) -> 'list[tuple[PoseShapeInterpolatorPose, float]]':
+        from .rbf import poses_within
+        return poses_within(self, radius)
 
     def _curve_node_tree_get(self) -> 'ShaderNodeTree':
         return curve_mapping_tree_get(self)
@@ -744,10 +940,15 @@ class PoseShapeInterpolators(PropertyGroup):
         options={'HIDDEN'}
         )# type: ignore
 
+    def bind_all(self) -> 'BatchReport':
+        from .rbf import bind_all
+        return bind_all((self.id_data,))
+
     def clear(self, unbind: bool = True) -> None:
         if unbind:
             for psi in self:
                 psi.unbind()
+        lookup_indices_clear()
         self.internal__.clear()
         self.active_index = 0
 
@@ -763,10 +964,18 @@ class PoseShapeInterpolators(PropertyGroup):
     def items(self) -> 'Iterator[tuple[str, PoseShapeInterpolator]]':
         return self.internal__.items()
 
+    def move(self, from_index: int, to_index: int) -> None:
+        # Interpolators hold the inputs and pose data the lookup indices are
+        # keyed by (their pointers), and adding, removing or moving one shifts
+        # the others in memory
+        lookup_indices_clear()
+        self.internal__.move(from_index, to_index)
+
     def new(self, name: str = "Pose Interpolator") -> 'PoseShapeInterpolator':
         if not isinstance(name, str):
             raise TypeError((f'PoseInterpolators.new(name): '
                              f'Expected name to be str, not {type(name)}'))
+        lookup_indices_clear()
         psi = self.internal__.add()
         psi._init(name)
         self.active_index = len(self) - 1
@@ -783,8 +992,30 @@ class PoseShapeInterpolators(PropertyGroup):
                               f'{interpolator} is not a member of this collection'))
         if unbind:
             interpolator.unbind()
+        lookup_indices_clear()
         self.internal__.remove(index)
         self.active_index = min(self.active_index, len(self) - 1)
 
     def values(self) -> 'Iterator[PoseShapeInterpolator]':
         return self.internal__.values()
+
+
+@persistent
+def lookup_indices_reset(*_) -> None:
+    lookup_indices_clear()
+    INPUT_POSE_TRS.clear()
+
+
+LOOKUP_HANDLERS = ("load_post", "undo_post", "redo_post")
+
+
+def register() -> None:
+    for name in LOOKUP_HANDLERS:
+        getattr(bpy.app.handlers, name).append(lookup_indices_reset)
+
+
+def unregister() -> None:
+    for name in LOOKUP_HANDLERS:
+        handlers = getattr(bpy.app.handlers, name)
+        if lookup_indices_reset in handlers:
+            handlers.remove(lookup_indices_reset)
@@ -2,6 +2,7 @@
 import bpy
 from mathutils import Matrix
 from uuid import uuid4
+from .utils import pose_data_find, pose_data_invalidate
 
 
 CMAP_PRESETS = {
@@ -263,23 +264,19 @@ def input_pose_update(ip, inp):
 
 
 def input_pose_get(pose, inp):
-    k = inp.handle
-    for ip in pose.data:
-        if ip.input_handle == k:
-            return ip
+    i = input_pose_find(pose, inp)
+    if i >= 0:
+        return pose.data[i]
 
 
 def input_pose_find(pose, inp):
-    k = inp.handle
-    for i, ip in pose.data:
-        if ip.input_handle == k:
-            return i
-    return -1
+    return pose_data_find(pose, pose.data, inp.handle)
 
 
 def input_pose_remove(pose, inp):
     i = input_pose_find(pose, inp)
     if i >= 0:
+        pose_data_invalidate(pose)
         pose.data.remove(i)
 
 
@@ -0,0 +1,189 @@
+from typing import TYPE_CHECKING
+import numpy as np
+if TYPE_CHECKING:
+    from typing import Callable, Iterator
+
+# Each pose's column of the inverse is solved over its nearest poses within
+# this many kernel radii of it. Columns of the inverse of a compactly supported
+# kernel matrix decay quickly away from the pose, so the rest is close to zero.
+SPARSE_HALO = 2.0
+
+# ...but over no more than this many of them, which bounds the cost of each
+# local solve however many poses fall within the halo (in a pose space with a
+# dozen channels that can be all of them)
+SPARSE_MAX_LOCAL = 48
+
+# Weights smaller than this (relative to the largest in their column) are dropped
+SPARSE_TOLERANCE = 1e-6
+
+# Average number of neighbours within the automatic sparse kernel radius
+SPARSE_NEIGHBOURS = 8
+
+# Below this many poses the exact dense solve is faster than the local sparse
+# solves (see benchmarks/solve.py), so sparse weights are only approximated above it
+SPARSE_MIN_POSES = 1500
+
+# Sparse weights that leave an error larger than this at any pose, max|KW - I|,
+# are solved exactly instead. benchmarks/solve.py measured 3e-3 to 5e-3 with the
+# automatic radius.
+SPARSE_MAX_RESIDUAL = 1e-2
+
+# Bounds the temporary arrays of the blocked computations to about this many floats
+SPARSE_BLOCK = 1 << 22
+
+
+class SparseMatrix:
+
+    def __init__(self,
+            indptr: 'np.ndarray',
+            indices: 'np.ndarray',
+            values: 'np.ndarray',
+            shape: 'tuple[int, int]') -> None:
+        # Compressed sparse rows
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.shape = shape
+
+    @classmethod
+    def from_triplets(cls,
+            rows: 'np.ndarray',
+            cols: 'np.ndarray',
+            values: 'np.ndarray',
+            shape: 'tuple[int, int]') -> 'SparseMatrix':
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(shape[0] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, cols[order], values[order], shape)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.values)
+
+    def _positions(self, rows: 'np.ndarray') -> 'tuple[np.ndarray, np.ndarray]':
+        # Positions of the stored entries of rows, and the row length of each
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return np.arange(len(offsets)) + offsets, lengths
+
+    def rows_dot(self, rows: 'np.ndarray', coeffs: 'np.ndarray') -> 'np.ndarray':
+        # coeffs @ self[rows], touching only the stored entries of those rows
+        positions, lengths = self._positions(rows)
+        return np.bincount(self.indices[positions],
+                           weights=self.values[positions] * np.repeat(coeffs, lengths),
+                           minlength=self.shape[1])
+
+    def scale_columns(self, factors: 'np.ndarray') -> 'SparseMatrix':
+        return SparseMatrix(self.indptr, self.indices, self.values * factors[self.indices], self.shape)
+
+    def toarray(self) -> 'np.ndarray':
+        array = np.zeros(self.shape)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        array[rows, self.indices] = self.values
+        return array
+
+
+def distance_blocks(data: 'np.ndarray') -> 'Iterator[tuple[int, np.ndarray]]':
+    # (first row, rows of the pairwise distance matrix) a block at a time
+    count = len(data)
+    sq = np.einsum('ij,ij->i', data, data)
+    step = max(1, SPARSE_BLOCK // max(count, 1))
+    for start in range(0, count, step):
+        stop = min(start + step, count)
+        d2 = sq[start:stop, np.newaxis] + sq[np.newaxis, :] - 2.0 * (data[start:stop] @ data.T)
+        np.maximum(d2, 0.0, out=d2)
+        yield start, np.sqrt(d2, out=d2)
+
+
+def nearest_neighbours(data: 'np.ndarray', count: int) -> 'tuple[np.ndarray, np.ndarray]':
+    # (poses, count) distances and indices of each pose's nearest poses in
+    # ascending order, starting with the pose itself
+    distances = np.empty((len(data), count))
+    indices = np.empty((len(data), count), dtype=np.intp)
+    for start, block in distance_blocks(data):
+        rows = np.arange(len(block))
+        block[rows, rows + start] = -1.0
+        nearest = np.argpartition(block, count - 1, axis=1)[:, :count]
+        values = np.take_along_axis(block, nearest, axis=1)
+        order = np.argsort(values, axis=1)
+        distances[start:start + len(block)] = np.take_along_axis(values, order, axis=1)
+        indices[start:start + len(block)] = np.take_along_axis(nearest, order, axis=1)
+    distances[:, 0] = 0.0
+    return distances, indices
+
+
+def sparse_radius(data: 'np.ndarray', neighbours: int = SPARSE_NEIGHBOURS) -> float:
+    # Mean distance to each pose's n-th nearest neighbour
+    count = len(data)
+    if count < 2:
+        return 1.0
+    neighbours = min(neighbours, count - 1)
+    radius = float(nearest_neighbours(data, neighbours + 1)[0][:, -1].mean())
+    return radius if radius > 1e-5 else 1.0
+
+
+def sparse_solve(data: 'np.ndarray',
+                 function: 'Callable[[np.ndarray, float], np.ndarray]',
+                 radius: float,
+                 regularization: float = 0.0,
+                 halo: float = SPARSE_HALO,
+                 local: int = SPARSE_MAX_LOCAL,
+                 tolerance: float = SPARSE_TOLERANCE) -> 'SparseMatrix':
+    # Approximate sparse inverse of the kernel matrix. Each pose's column is
+    # solved exactly over its local neighbourhood, so every pose still
+    # interpolates to exactly 1, but other poses within the kernel radius of
+    # it only come out close to 0. The neighbourhoods are padded to the same
+    # size (with identity rows) and solved in batches.
+    count = len(data)
+    size = min(local, count)
+    distances, indices = nearest_neighbours(data, size)
+    inside = distances <= radius * halo
+    # Each pose is the first of its own neighbourhood
+    targets = np.zeros((size, 1))
+    targets[0] = 1.0
+    diagonal = np.arange(size)
+    columns = np.empty((count, size))
+    step = max(1, SPARSE_BLOCK // (size * size))
+    for start in range(0, count, step):
+        points = data[indices[start:start + step]]
+        mask = inside[start:start + step]
+        sq = np.einsum('pij,pij->pi', points, points)
+        d2 = sq[:, :, np.newaxis] + sq[:, np.newaxis, :] - 2.0 * (points @ points.transpose(0, 2, 1))
+        np.maximum(d2, 0.0, out=d2)
+        blocks = function(np.sqrt(d2, out=d2), radius)
+        blocks *= mask[:, :, np.newaxis] & mask[:, np.newaxis, :]
+        blocks[:, diagonal, diagonal] = np.where(mask, blocks[:, diagonal, diagonal] + regularization, 1.0)
+        try:
+            columns[start:start + step] = np.linalg.solve(blocks, targets)[..., 0]
+        except np.linalg.LinAlgError:
+            raise RuntimeError('Pose matrix is singular (check for duplicate poses)')
+    magnitudes = np.abs(columns)
+    keep = inside & (magnitudes > tolerance * magnitudes.max(axis=1, keepdims=True))
+    return SparseMatrix.from_triplets(indices[keep],
+                                      np.repeat(np.arange(count), keep.sum(axis=1)),
+                                      columns[keep],
+                                      (count, count))
+
+
+def sparse_residual(data: 'np.ndarray',
+                    function: 'Callable[[np.ndarray, float], np.ndarray]',
+                    radius: float,
+                    regularization: float,
+                    weights: 'SparseMatrix') -> float:
+    # max|KW - I|, how far from 0 and 1 the weights interpolate the poses. A
+    # block of kernel rows at a time, each row through only its nonzero
+    # entries (the poses within the radius).
+    count = len(data)
+    residual = 0.0
+    for start, block in distance_blocks(data):
+        values = function(block, radius)
+        rows, cols = np.nonzero(values)
+        coeffs = values[rows, cols] + np.where(rows + start == cols, regularization, 0.0)
+        positions, lengths = weights._positions(cols)
+        product = np.bincount(np.repeat(rows, lengths) * count + weights.indices[positions],
+                              weights=weights.values[positions] * np.repeat(coeffs, lengths),
+                              minlength=len(block) * count).reshape(len(block), count)
+        product[np.arange(len(block)), np.arange(len(block)) + start] -= 1.0
+        residual = max(residual, float(np.abs(product).max()))
+    return residual
@@ -0,0 +1,106 @@
+
+from heapq import heappop, heappush
+import numpy as np
+
+
+class KDTree:
+
+    def __init__(self, points: 'np.ndarray', leaf_size: int = 16) -> None:
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        self.indices = np.arange(len(self.points))
+        self.leaf_size = max(1, leaf_size)
+        # node arrays, children of leaves are -1
+        self.start = []
+        self.end = []
+        self.left = []
+        self.right = []
+        self.lower = []
+        self.upper = []
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _build(self, start: int, end: int) -> int:
+        node = len(self.start)
+        points = self.points[self.indices[start:end]]
+        self.start.append(start)
+        self.end.append(end)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.lower.append(points.min(axis=0))
+        self.upper.append(points.max(axis=0))
+        count = end - start
+        if count > self.leaf_size:
+            axis = int(np.argmax(self.upper[node] - self.lower[node]))
+            half = count // 2
+            order = np.argpartition(points[:, axis], half)
+            self.indices[start:end] = self.indices[start:end][order]
+            self.left[node] = self._build(start, start + half)
+            self.right[node] = self._build(start + half, end)
+        return node
+
+    def _min_distance_sq(self, node: int, point: 'np.ndarray') -> float:
+        gap = np.maximum(self.lower[node] - point, 0.0) + np.maximum(point - self.upper[node], 0.0)
+        return float(gap @ gap)
+
+    def _leaf(self, node: int, point: 'np.ndarray') -> 'tuple[np.ndarray, np.ndarray]':
+        indices = self.indices[self.start[node]:self.end[node]]
+        delta = self.points[indices] - point
+        return indices, np.einsum('ij,ij->i', delta, delta)
+
+    def query(self, point: 'np.ndarray', count: int = 1) -> 'tuple[np.ndarray, np.ndarray]':
+        # k nearest neighbours as (distances, indices), nearest first
+        point = np.asarray(point, dtype=np.float64)
+        count = min(count, len(self.points))
+        best_indices = np.empty(0, dtype=np.intp)
+        best_dist_sq = np.empty(0)
+        if count < 1:
+            return best_dist_sq, best_indices
+        bound = np.inf
+        heap = [(self._min_distance_sq(0, point), 0)]
+        while heap:
+            dist_sq, node = heappop(heap)
+            if dist_sq > bound:
+                break
+            if self.left[node] < 0:
+                indices, leaf_dist_sq = self._leaf(node, point)
+                best_indices = np.concatenate((best_indices, indices))
+                best_dist_sq = np.concatenate((best_dist_sq, leaf_dist_sq))
+                if len(best_indices) > count:
+                    keep = np.argpartition(best_dist_sq, count - 1)[:count]
+                    best_indices = best_indices[keep]
+                    best_dist_sq = best_dist_sq[keep]
+                if len(best_indices) == count:
+                    bound = best_dist_sq.max()
+                continue
+            for child in (self.left[node], self.right[node]):
+                child_dist_sq = self._min_distance_sq(child, point)
+                if child_dist_sq <= bound:
+                    heappush(heap, (child_dist_sq, child))
+        order = np.argsort(best_dist_sq)
+        return np.sqrt(best_dist_sq[order]), best_indices[order]
+
+    def query_radius(self, point: 'np.ndarray', radius: float) -> 'tuple[np.ndarray, np.ndarray]':
+        # all points within radius as (distances, indices), unordered
+        point = np.asarray(point, dtype=np.float64)
+        radius_sq = radius * radius
+        found_indices = []
+        found_dist_sq = []
+        stack = [0] if len(self.points) else []
+        while stack:
+            node = stack.pop()
+            if self._min_distance_sq(node, point) > radius_sq:
+                continue
+            if self.left[node] < 0:
+                indices, dist_sq = self._leaf(node, point)
+                mask = dist_sq <= radius_sq
+                found_indices.append(indices[mask])
+                found_dist_sq.append(dist_sq[mask])
+            else:
+                stack.append(self.left[node])
+                stack.append(self.right[node])
+        if not found_indices:
+            return np.empty(0), np.empty(0, dtype=np.intp)
+        return np.sqrt(np.concatenate(found_dist_sq)), np.concatenate(found_indices)
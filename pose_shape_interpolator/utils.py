@@ -3,10 +3,126 @@ from bpy.types import FCurve, ID
 from math import isclose, sqrt
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from typing import Iterable
+    from typing import Any, Iterable
+    from bpy.types import Driver, DriverVariable, bpy_prop_collection, bpy_struct
 
 
-def driver_find(id_: 'ID', path: str, index: int=-1) -> 'FCurve|None':
+class DriverIndex:
+
+    def __init__(self, id_: 'ID') -> None:
+        # (data_path, array_index) -> FCurve, built on first use and kept up
+        # to date by new() and remove(). Scope it to a single bind or batch,
+        # as drivers changed elsewhere aren't seen.
+        self.id = id_
+        self._fcurves: 'dict[tuple[str, int], FCurve]|None' = None
+
+    def _map(self) -> 'dict[tuple[str, int], FCurve]':
+        if self._fcurves is None:
+            ad = self.id.animation_data
+            self._fcurves = {} if ad is None else {(fc.data_path, fc.array_index): fc for fc in ad.drivers}
+        return self._fcurves
+
+    def __contains__(self, path: 'tuple[str, int]') -> bool:
+        return path in self._map()
+
+    def find(self, path: str, index: int=-1) -> 'FCurve|None':
+        return self._map().get((path, max(index, 0)))
+
+    def new(self, path: str, index: int=-1) -> 'FCurve':
+        fx = self.id.animation_data_create().drivers
+        fc = fx.new(path, index=index) if index >= 0 else fx.new(path)
+        self._map()[(path, max(index, 0))] = fc
+        return fc
+
+    def remove(self, fc: 'FCurve') -> None:
+        self._map().pop((fc.data_path, fc.array_index), None)
+        self.id.animation_data.drivers.remove(fc)
+
+
+# Pointer of the struct that owns a collection of input pose data -> the index
+# of each item by input handle. Built on first lookup and dropped when items are
+# added or removed. Anything else that shifts the items (moves, undo, a pointer
+# reused by another struct) is caught by checking the handle of the item found,
+# and a handle that isn't found rebuilds it before giving up.
+POSE_DATA_INDEX: 'dict[int, dict[str, int]]' = {}
+
+
+def pose_data_find(owner: 'bpy_struct', items: 'bpy_prop_collection', handle: str) -> int:
+    key = owner.as_pointer()
+    index = POSE_DATA_INDEX.get(key)
+    if index is not None:
+        i = index.get(handle, -1)
+        if 0 <= i < len(items) and items[i].input_handle == handle:
+            return i
+    index = POSE_DATA_INDEX[key] = {item.input_handle: i for i, item in enumerate(items)}
+    return index.get(handle, -1)
+
+
+def pose_data_invalidate(owner: 'bpy_struct') -> None:
+    POSE_DATA_INDEX.pop(owner.as_pointer(), None)
+
+
+# Pointer of the struct that owns a collection of inputs -> (item count, name
+# -> indices of the inputs with that name). Built on first lookup and dropped
+# when inputs are added, removed, moved or renamed. A hit is checked against
+# the input's name, a miss is only trusted while the count still matches.
+INPUT_NAME_INDEX: 'dict[int, tuple[int, dict[str, list[int]]]]' = {}
+
+
+def input_name_index(owner: 'bpy_struct', items: 'bpy_prop_collection') -> 'dict[str, list[int]]':
+    key = owner.as_pointer()
+    cached = INPUT_NAME_INDEX.get(key)
+    if cached is not None and cached[0] == len(items):
+        return cached[1]
+    index = {}
+    for i, item in enumerate(items):
+        index.setdefault(item.name, []).append(i)
+    INPUT_NAME_INDEX[key] = (len(items), index)
+    return index
+
+
+def input_name_find(owner: 'bpy_struct', items: 'bpy_prop_collection', name: str) -> int:
+    indices = input_name_index(owner, items).get(name)
+    if indices is None:
+        return -1
+    i = indices[0]
+    if items[i].name != name:
+        input_name_invalidate(owner)
+        return input_name_find(owner, items, name)
+    return i
+
+
+def input_name_invalidate(owner: 'bpy_struct') -> None:
+    INPUT_NAME_INDEX.pop(owner.as_pointer(), None)
+
+
+def lookup_indices_clear() -> None:
+    # Undo and file loads swap the data out from under the pointers
+    POSE_DATA_INDEX.clear()
+    INPUT_NAME_INDEX.clear()
+
+
+def ik_chain_bones(pose_bones: 'bpy_prop_collection') -> 'set[str]':
+    # Names of the bones an IK or Spline IK constraint solves, whose pose
+    # matrices (and so local transforms) aren't what matrix_basis says
+    names = set()
+    for pb in pose_bones:
+        for con in pb.constraints:
+            if con.type not in {'IK', 'SPLINE_IK'}:
+                continue
+            # A chain length of 0 runs all the way to the root
+            count = con.chain_count or -1
+            bone = pb
+            while bone is not None and count != 0:
+                names.add(bone.name)
+                bone = bone.parent
+                count -= 1
+    return names
+
+
+def driver_find(id_: 'ID', path: str, index: int=-1, cache: 'DriverIndex|None'=None) -> 'FCurve|None':
+    if cache is not None:
+        return cache.find(path, index)
     ad = id_.animation_data
     if ad is None:
         return
@@ -14,9 +130,13 @@ def driver_find(id_: 'ID', path: str, index: int=-1) -> 'FCurve|None':
     return fx.find(path) if index < 0 else fx.find(path, index=index)
 
 
-def driver_remove(id_: 'ID', path: str, index: int=-1) -> None:
-    fc = driver_find(id_, path, index)
-    if fc is not None:
+def driver_remove(id_: 'ID', path: str, index: int=-1, cache: 'DriverIndex|None'=None) -> None:
+    fc = driver_find(id_, path, index, cache)
+    if fc is None:
+        return
+    if cache is not None:
+        cache.remove(fc)
+    else:
         fc.id_data.animation_data.drivers.remove(fc)
 
 
@@ -24,12 +144,16 @@ def driver_ensure(id_: 'ID',
                   path: str,
                   index: int=-1,
                   clear_variables: bool=False,
-                  reset_keyframes: bool=False) -> 'FCurve':
-    fc = driver_find(id_, path, index)
+                  reset_keyframes: bool=False,
+                  cache: 'DriverIndex|None'=None) -> 'FCurve':
+    fc = driver_find(id_, path, index, cache)
 
     if fc is None:
-        fx = id_.animation_data_create().drivers
-        fc = fx.new(path, index=index) if index >= 0 else fx.new(path)
+        if cache is not None:
+            fc = cache.new(path, index)
+        else:
+            fx = id_.animation_data_create().drivers
+            fc = fx.new(path, index=index) if index >= 0 else fx.new(path)
 
     if clear_variables:
         vars = fc.driver.variables
@@ -59,6 +183,83 @@ def driver_ensure(id_: 'ID',
     return fc
 
 
+def driver_variable_add(driver: 'Driver',
+                        name: str,
+                        type: str,
+                        targets: 'Iterable[dict[str, Any]]') -> 'DriverVariable':
+    var = driver.variables.new()
+    var.type = type
+    var.name = name
+    for tgt, settings in zip(var.targets, targets):
+        for attr, value in settings.items():
+            setattr(tgt, attr, value)
+    return var
+
+
+def driver_variables_match(driver: 'Driver', variables: 'list[dict[str, Any]]') -> bool:
+    vars = driver.variables
+    if len(vars) != len(variables):
+        return False
+    for var, spec in zip(vars, variables):
+        if var.name != spec["name"] or var.type != spec["type"]:
+            return False
+        for tgt, settings in zip(var.targets, spec["targets"]):
+            for attr, value in settings.items():
+                if getattr(tgt, attr) != value:
+                    return False
+    return True
+
+
+def driver_update(fc: 'FCurve', spec: 'dict[str, Any]') -> bool:
+    # Brings the driver in line with spec, returns True if anything changed
+    dr = fc.driver
+    changed = False
+    if dr.type != spec["type"]:
+        dr.type = spec["type"]
+        changed = True
+    if dr.use_self != spec.get("use_self", False):
+        dr.use_self = spec.get("use_self", False)
+        changed = True
+    if not driver_variables_match(dr, spec["variables"]):
+        vars = dr.variables
+        while len(vars):
+            vars.remove(vars[-1])
+        for var in spec["variables"]:
+            driver_variable_add(dr, var["name"], var["type"], var["targets"])
+        changed = True
+    if dr.expression != spec["expression"]:
+        dr.expression = spec["expression"]
+        changed = True
+    return changed
+
+
+def drivers_sync(id_: 'ID',
+                 graph: 'dict[tuple[str, int], dict[str, Any]]',
+                 owned: 'Iterable[tuple[str, int]]' = (),
+                 cache: 'DriverIndex|None' = None) -> int:
+    # Makes the drivers on id_ match graph, (data_path, array_index) -> spec.
+    # Previously owned drivers that aren't in the graph are removed, drivers
+    # that already match are left alone. Returns the number of FCurves added,
+    # changed or removed.
+    if cache is None:
+        cache = DriverIndex(id_)
+    touched = 0
+    for path, index in owned:
+        if (path, index) not in graph:
+            fc = cache.find(path, index)
+            if fc is not None:
+                cache.remove(fc)
+                touched += 1
+    for (path, index), spec in graph.items():
+        fc = cache.find(path, index)
+        if fc is None:
+            driver_update(cache.new(path, index), spec)
+            touched += 1
+        elif driver_update(fc, spec):
+            touched += 1
+    return touched
+
+
 def sum_of_squares(vec: list[float]) -> float:
     return sum(x**2 for x in vec)
 
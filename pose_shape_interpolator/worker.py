@@ -0,0 +1,33 @@
+
+# Run by path (runpy.run_path) to set up the processes bind plans are made in.
+# They're plain python without bpy, so the add-on package is registered as an
+# empty namespace there, which lets its bpy-free modules be imported without
+# running its __init__. PACKAGE is the add-on's package name.
+import os
+import sys
+from types import ModuleType
+
+# Passed in by run_path()
+PACKAGE: str = globals().get("PACKAGE", "")
+
+
+def package_register(package: str, path: str) -> None:
+    if package in sys.modules:
+        return
+    parts = package.split(".")
+    for index in range(1, len(parts)):
+        name = ".".join(parts[:index])
+        if name not in sys.modules:
+            parent = ModuleType(name)
+            parent.__path__ = []
+            sys.modules[name] = parent
+    module = ModuleType(package)
+    module.__path__ = [path]
+    sys.modules[package] = module
+
+
+# One process per core already, so numpy's BLAS shouldn't start threads of its own
+for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(name, "1")
+
+package_register(PACKAGE, os.path.dirname(os.path.abspath(__file__)))
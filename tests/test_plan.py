@@ -0,0 +1,124 @@
+
+# Planning is bpy-free, so these run with plain python: the add-on package is
+# registered the way plan worker processes register it, without running its
+# __init__ (which needs blender).
+import os
+from runpy import run_path
+import numpy as np
+
+run_path(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      "pose_shape_interpolator", "worker.py"),
+         {"PACKAGE": "pose_shape_interpolator"})
+
+from pose_shape_interpolator.expressions import MAX_EXPRESSION_LENGTH
+from pose_shape_interpolator.kernels import KERNELS
+from pose_shape_interpolator.plan import (
+    InputSettings,
+    PlanRequest,
+    PoseSettings,
+    ChannelTable,
+    bind_plan,
+    distance_matrix,
+    loo_errors,
+    normalize_channels,
+    pose_distances,
+    pose_driver_path,
+    variable_name
+    )
+from pose_shape_interpolator.sparse import sparse_radius, sparse_residual, sparse_solve
+
+
+def rotation_matrices(rng: 'np.random.Generator', shape: 'tuple[int, ...]') -> 'np.ndarray':
+    w, x, y, z = np.moveaxis(rng.normal(size=(*shape, 4)), -1, 0)
+    norm = 2.0 / (w * w + x * x + y * y + z * z)
+    matrices = np.zeros((*shape, 4, 4))
+    matrices[..., 0, :3] = np.stack((1.0 - norm * (y * y + z * z), norm * (x * y - w * z), norm * (x * z + w * y)), -1)
+    matrices[..., 1, :3] = np.stack((norm * (x * y + w * z), 1.0 - norm * (x * x + z * z), norm * (y * z - w * x)), -1)
+    matrices[..., 2, :3] = np.stack((norm * (x * z - w * y), norm * (y * z + w * x), 1.0 - norm * (x * x + y * y)), -1)
+    matrices[..., 3, 3] = 1.0
+    return matrices
+
+
+def plan_request(inputs: int, poses: int, simple: bool) -> 'PlanRequest':
+    # Every input a swing and twist rotation, four channels each
+    rng = np.random.default_rng(0)
+    return PlanRequest("8f2c1d5e-6a7b-4c3d-9e0f-1a2b3c4d5e6f",
+                       tuple(InputSettings("Armature", f'Bone.{index:03}', (False, False, False), True,
+                                           'SWING_TWIST', 'Y', (False, False, False))
+                             for index in range(inputs)),
+                       rotation_matrices(rng, (inputs, poses)),
+                       tuple(PoseSettings(f'pose.{index}', f'Pose.{index:03}', 0.0, 1.0, True)
+                             for index in range(poses)),
+                       'GAUSSIAN',
+                       0.0,
+                       False,
+                       0.0,
+                       simple,
+                       "",
+                       "",
+                       "")
+
+
+def test_variable_names_are_unique() -> None:
+    names = [variable_name(index) for index in range(2000)]
+    assert len(set(names)) == len(names)
+    assert all(name.isidentifier() for name in names)
+
+
+def test_bind_many_channels() -> None:
+    # 40 inputs are 160 channels, more than fit in any one expression
+    for simple in (False, True):
+        request = plan_request(40, 24, simple)
+        plan = bind_plan(request)
+        assert plan.props[f'{request.handle}.vector'] == 160
+        for spec in plan.specs.values():
+            assert len(spec["expression"]) <= MAX_EXPRESSION_LENGTH
+        for pose in request.poses:
+            spec = plan.specs[pose_driver_path(pose)]
+            if spec.get("use_self"):
+                # Python drivers read the vector themselves, whatever its size
+                assert len(spec["variables"]) == 1
+
+
+def test_pose_distances_use_the_geodesic_angle() -> None:
+    request = plan_request(3, 12, False)
+    scales = normalize_channels(ChannelTable(request.inputs, request.matrices).posedata)
+    distances = pose_distances(request.inputs, request.matrices, request.matrices[:, 5], scales)
+    assert np.argmin(distances) == 5 and distances[5] < 1e-6
+    # A half turn about the twist axis from pose 5, on the first input only
+    current = request.matrices[:, 5].copy()
+    current[0, :3, :3] = current[0, :3, :3] @ np.diag((-1.0, 1.0, -1.0))
+    distances = pose_distances(request.inputs, request.matrices, current, scales)
+    columns = ChannelTable(request.inputs, request.matrices).channels["input"] == 0
+    assert np.isclose(distances[5], np.pi / scales[columns].mean())
+
+
+
+def test_loo_errors_match_refitting() -> None:
+    # Each pose left out in turn, the others' shapes predicted at it
+    rng = np.random.default_rng(0)
+    points = rng.normal(size=(20, 3))
+    points[1] = points[0] + 1e-4
+    kernel = np.exp(-np.square(np.linalg.norm(points[:, np.newaxis] - points, axis=-1) / 1.5))
+    lambdas = np.array((1e-6, 1e-3, 1e-1))
+    errors = loo_errors(*np.linalg.eigh(kernel), lambdas)
+    for error, value in zip(errors, lambdas):
+        expected = 0.0
+        for index in range(len(points)):
+            kept = np.arange(len(points)) != index
+            weights = np.linalg.solve(kernel[np.ix_(kept, kept)] + value * np.identity(len(points) - 1),
+                                      np.identity(len(points))[kept])
+            missed = kernel[index, kept] @ weights - np.identity(len(points))[index]
+            expected += np.sum(np.square(np.delete(missed, index)))
+        assert np.isclose(error, expected, rtol=1e-6)
+
+
+def test_sparse_residual() -> None:
+    rng = np.random.default_rng(0)
+    data = rng.uniform(size=(400, 6))
+    function = KERNELS['WENDLAND'].function
+    radius = sparse_radius(data)
+    weights = sparse_solve(data, function, radius, 0.01)
+    kernel = function(distance_matrix(data), radius) + 0.01 * np.identity(len(data))
+    expected = np.abs(kernel @ weights.toarray() - np.identity(len(data))).max()
+    assert np.isclose(sparse_residual(data, function, radius, 0.01, weights), expected)